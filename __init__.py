@@ -13,7 +13,8 @@ from .path_config import (
     JOBS_DIR,
 )
 
-from .helper_functions import sanitize_filename, json_converter
+from .helper_functions import sanitize_filename, json_converter, HostRateLimiter
+from .request_cache import RequestCache, get_request_cache
 
 __all__ = [
     "DBT_DIR",
@@ -28,4 +29,7 @@ __all__ = [
     "JOBS_DIR",
     "sanitize_filename",
     "json_converter",
+    "HostRateLimiter",
+    "RequestCache",
+    "get_request_cache",
 ]
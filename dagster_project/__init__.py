@@ -5,10 +5,8 @@ from dagster_project.assets import (
     dbt_geo_models,
     rick_and_morty_asset,
     dbt_rick_and_morty_models,
-    ingredients_table,
-    alcoholic_table,
-    beverages_table,
-    glass_table,
+    beverage_dimension_tables,
+    drink_details_table,
     beverage_fact_data,
     dbt_beverage_data,
     openmeteo_asset,
@@ -18,7 +16,8 @@ from dagster_project.jobs import (
     geo_data_job,
     RickandMorty_job,
     dbt_job,
-    open_meteo_job
+    open_meteo_job,
+    weather_dbt_job
 )
 from dagster_project.schedules import schedules
 from dagster_project.sensors import dbt_sensor
@@ -32,10 +31,8 @@ __all__ = [
     "dbt_geo_models",
     "rick_and_morty_asset",
     "dbt_rick_and_morty_models",
-    "ingredients_table",
-    "alcoholic_table",
-    "beverages_table",
-    "glass_table",
+    "beverage_dimension_tables",
+    "drink_details_table",
     "beverage_fact_data",
     "dbt_beverage_data",
     "openmeteo_asset",
@@ -45,6 +42,7 @@ __all__ = [
     "RickandMorty_job",
     "dbt_job",
     "open_meteo_job",
+    "weather_dbt_job",
     # Others
     "schedules",
     "dbt_sensor",
@@ -1,14 +1,14 @@
-from dagster import asset, AssetExecutionContext, Output
+from dagster import asset, multi_asset, AssetExecutionContext, AssetOut, Output
 import os
 import requests
-from dlt.sources.helpers import requests as dlt_requests
 from dotenv import load_dotenv
 import pandas as pd
-import time
-import json
-from datetime import datetime, timedelta
-from path_config import ENV_FILE, DLT_PIPELINE_DIR, REQUEST_CACHE_DIR
-from helper_functions import sanitize_filename
+from datetime import timedelta
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from path_config import ENV_FILE, DLT_PIPELINE_DIR
+from helper_functions import HostRateLimiter, rate_limited_get
+from request_cache import get_request_cache, conditional_get_json
 
 load_dotenv(dotenv_path=ENV_FILE)
 
@@ -16,12 +16,25 @@ API_KEY = os.getenv("BEVERAGE_API_KEY")
 if not API_KEY:
     raise ValueError("Environment variable BEVERAGE_API_KEY is not set.")
 
+# Worker pool size for the filter.php fan-out, set to 1 to fetch serially
+FETCH_WORKERS = int(os.getenv("BEVERAGE_FETCH_WORKERS", "8"))
+# Shared by every Beverages asset so assets running side by side don't stack their request rates
+RATE_LIMITER = HostRateLimiter(
+    rate=float(os.getenv("BEVERAGE_REQUESTS_PER_SECOND", "10")), burst=FETCH_WORKERS)
+
+# randomselection.php sampling: distinct drinks wanted, hard cap on calls, and how many
+# rounds in a row may return nothing new before we stop early
+SAMPLE_SIZE = int(os.getenv("BEVERAGE_SAMPLE_SIZE", "100"))
+SAMPLE_MAX_REQUESTS = int(os.getenv("BEVERAGE_SAMPLE_MAX_REQUESTS", "50"))
+SAMPLE_PATIENCE = int(os.getenv("BEVERAGE_SAMPLE_PATIENCE", "2"))
+
 DIMENSION_CONFIG = {
     "ingredients": {
         "list_api": ("i=list", "strIngredient1"),
         "query_param": "i",
         "source_key": "source_ingredient",
         "resource_name": "ingredients_table",
+        "asset_name": "ingredients_table",
         "primary_key": ["id_drink", "source_ingredient"]
     },
     "alcoholic": {
@@ -29,6 +42,7 @@ DIMENSION_CONFIG = {
         "query_param": "a",
         "source_key": "source_alcohol_type",
         "resource_name": "alcoholic_table",
+        "asset_name": "alcoholic_table",
         "primary_key": ["id_drink"]
     },
     "beverages": {
@@ -36,6 +50,7 @@ DIMENSION_CONFIG = {
         "query_param": "c",
         "source_key": "source_beverage_type",
         "resource_name": "beverages_table",
+        "asset_name": "beverages_table",
         "primary_key": ["id_drink"]
     },
     "glasses": {
@@ -43,40 +58,39 @@ DIMENSION_CONFIG = {
         "query_param": "g",
         "source_key": "source_glass",
         "resource_name": "glasses_table",
+        "asset_name": "glass_table",
         "primary_key": ["id_drink"]
     }
 }
 
+# Output holding one row per distinct drink, the dimension outputs only carry ids
+DRINK_STORE_NAME = "drinks_table"
 
-def fetch_and_extract(table: str, config: dict, context) -> list:
-    # Check if the cache directory exists, if not, create it
-    REQUEST_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+# list.php and filter.php responses are reused for 72 hours, lookup.php drink details never change
+LIST_CACHE_NAMESPACE = "beverages_list"
+FILTER_CACHE_NAMESPACE = "beverages_filter"
+DETAILS_CACHE_NAMESPACE = "beverages_lookup"
+REQUEST_CACHE = get_request_cache()
+REQUEST_CACHE.register_namespace(
+    LIST_CACHE_NAMESPACE, timedelta(hours=72).total_seconds())
+REQUEST_CACHE.register_namespace(
+    FILTER_CACHE_NAMESPACE, timedelta(hours=72).total_seconds())
+REQUEST_CACHE.register_namespace(DETAILS_CACHE_NAMESPACE, None)
+# Serve expired list.php and filter.php responses immediately and refresh them off the critical path
+STALE_WHILE_REVALIDATE = os.getenv(
+    "BEVERAGE_STALE_WHILE_REVALIDATE", "true").lower() == "true"
 
-    cache_file = REQUEST_CACHE_DIR / f"{table}.json"
 
+def fetch_and_extract(table: str, config: dict, context) -> list:
     param, field = config["list_api"]
 
-    # Check if the cache file exists and is less than 74 hours old
-    if cache_file.exists():
-        context.log.info(
-            f"✅ Using cached response for table: {table} Param: {param} field: {field}")
-        file_mtime = datetime.fromtimestamp(cache_file.stat().st_mtime)
-        if datetime.now() - file_mtime < timedelta(hours=72):
-            with open(cache_file, "r") as f:
-                data = json.load(f)
-                for key, value in data.items():
-                    if isinstance(value, list) and all(isinstance(item, dict) for item in value):
-                        return [item.get(field) for item in value if field in item]
-
     url = f"https://www.thecocktaildb.com/api/json/v2/{API_KEY}/list.php?{param}"
 
-    response = dlt_requests.get(url)
-    response.raise_for_status()  # Raise exception on error
-    data = response.json()
-
-    # Cache the response
-    with open(cache_file, "w") as f:
-        json.dump(data, f, indent=2)
+    # Expired lists are revalidated with ETag/Last-Modified, and with stale-while-revalidate
+    # the cached list is used straight away while the refresh runs in the background
+    data = conditional_get_json(
+        REQUEST_CACHE, LIST_CACHE_NAMESPACE, table, url, partial(rate_limited_get, RATE_LIMITER),
+        stale_while_revalidate=STALE_WHILE_REVALIDATE)
 
     # Find the first key containing a list of dicts
     for key, value in data.items():
@@ -87,195 +101,242 @@ def fetch_and_extract(table: str, config: dict, context) -> list:
 
 
 def resource_dim_request_cache(resource, query_param, value, context):
-    REQUEST_CACHE_DIR.mkdir(parents=True, exist_ok=True)
-
-    cache_file = REQUEST_CACHE_DIR / \
-        f"{resource}_{query_param}_{sanitize_filename(value)}.json"
-
-    # Check if the cache file exists and is less than 72 hours old
-    if cache_file.exists():
-        # logger.info(f"✅ Using cached response for {query_param}={sanitize_filename(value)}")
-        file_mtime = datetime.fromtimestamp(cache_file.stat().st_mtime)
-        if datetime.now() - file_mtime < timedelta(hours=72):
-            with open(cache_file, "r") as f:
-                return json.load(f)
-    else:
-        context.log.info(
-            f"❌ No cache found for {query_param}={value}, fetching from API...")
+    cache_key = f"{resource}:{query_param}={value}"
 
     url = f"https://www.thecocktaildb.com/api/json/v2/{API_KEY}/filter.php?{query_param}={value}"
 
     try:
-        response = dlt_requests.get(url)
-        response.raise_for_status()  # Raise exception on error
-        data = response.json()["drinks"]
+        data = conditional_get_json(
+            REQUEST_CACHE, FILTER_CACHE_NAMESPACE, cache_key, url, partial(rate_limited_get, RATE_LIMITER),
+            stale_while_revalidate=STALE_WHILE_REVALIDATE)["drinks"]
     except Exception as e:
         context.log.warning(
             f"❌ Failed to fetch drinks for value '{value}': {e}")
         return []
 
-    with open(cache_file, "w") as f:
-        json.dump(data, f, indent=2)
-
     return data
 
 
-@asset(compute_kind="python", group_name="Beverages", tags={"source": "Beverages"})
-def ingredients_table(context: AssetExecutionContext) -> Output:
+def sample_random_drinks(context, sample_size: int = SAMPLE_SIZE, max_requests: int = SAMPLE_MAX_REQUESTS,
+                         patience: int = SAMPLE_PATIENCE) -> tuple:
+    """Calls randomselection.php in parallel rounds until `sample_size` distinct drinks are found.
 
-    config = DIMENSION_CONFIG["ingredients"]
+    Stops early once `patience` rounds in a row add no new idDrink. Returns the
+    drinks and the number of calls made.
+    """
+    url = f"https://www.thecocktaildb.com/api/json/v2/{API_KEY}/randomselection.php"
 
-    values = fetch_and_extract("ingredients", config, context)
-    context.log.info(f"Creating resource: ingredients")
-    drink_list = []
-    for value in values:
+    def fetch_random(i):
         try:
-            drinks = resource_dim_request_cache(
-                config['resource_name'], config['query_param'], value, context)
+            response = rate_limited_get(RATE_LIMITER, url, timeout=10)
+            response.raise_for_status()
+            drinks = response.json().get("drinks", [])
+
+            if not drinks:
+                context.log.warning(
+                    f"No drinks returned in iteration {i+1}")
+                return []
+            return drinks
+        except requests.RequestException as e:
+            context.log.error(
+                f"Request failed on iteration {i+1}: {e}", exc_info=True)
         except Exception as e:
             context.log.error(
-                f"❌ Failed to fetch drinks for {config['query_param']}={value}: {e}")
-            continue
-
-        if not drinks or drinks == 'None Found':
-            # context.log.warning(
-            #     f"No drinks found for {config['query_param']}={value}")
-            continue
-
-        for drink in drinks:
-            if isinstance(drink, dict):
-                drink[config["source_key"]] = value
-                drink_list.append(drink)
-            else:
-                context.log.warning(f"Skipping non-dict drink: {drink!r}")
-
-    df = pd.DataFrame(data=drink_list)
-
-    return Output(
-        df,
-        metadata={
-            "row_count": len(df),
-            "columns": ", ".join(df.columns),
-        }
-    )
-
-
-@asset(compute_kind="python", group_name="Beverages", tags={"source": "Beverages"})
-def alcoholic_table(context: AssetExecutionContext) -> Output:
-
-    config = DIMENSION_CONFIG["alcoholic"]
+                f"Unexpected error on iteration {i+1}: {e}", exc_info=True)
+        return []
 
-    values = fetch_and_extract("alcoholic", config, context)
-    context.log.info(f"Creating resource: alcoholic")
-    drink_list = []
-    for value in values:
+    drinks_by_id = {}
+    requests_made = 0
+    rounds_without_new = 0
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        while len(drinks_by_id) < sample_size and requests_made < max_requests:
+            batch = range(requests_made, min(
+                requests_made + FETCH_WORKERS, max_requests))
+            requests_made += len(batch)
+
+            new_drinks = 0
+            for drinks in executor.map(fetch_random, batch):
+                for drink in drinks:
+                    if isinstance(drink, dict) and drink.get("idDrink") and drink["idDrink"] not in drinks_by_id:
+                        drinks_by_id[drink["idDrink"]] = drink
+                        new_drinks += 1
+
+            rounds_without_new = 0 if new_drinks else rounds_without_new + 1
+            if rounds_without_new >= patience:
+                context.log.info(
+                    f"⏹️ Stopping random sampling after {requests_made} calls: "
+                    f"{patience} rounds without a new drink")
+                break
+
+    return list(drinks_by_id.values())[:sample_size], requests_made
+
+
+def fetch_drink_details(drink_ids: list, context) -> tuple:
+    """Returns lookup.php details for every id, only calling the API for ids missing from the cache."""
+    details = {}
+    missing = []
+    for drink_id in drink_ids:
+        cached = REQUEST_CACHE.get(DETAILS_CACHE_NAMESPACE, drink_id)
+        if cached is not None:
+            details[drink_id] = cached
+        else:
+            missing.append(drink_id)
+
+    context.log.info(
+        f"Drink details: {len(details)} cached, {len(missing)} to fetch")
+
+    def fetch_detail(drink_id):
+        url = f"https://www.thecocktaildb.com/api/json/v2/{API_KEY}/lookup.php?i={drink_id}"
         try:
-            drinks = resource_dim_request_cache(
-                config['resource_name'], config['query_param'], value, context)
+            response = rate_limited_get(RATE_LIMITER, url, timeout=10)
+            response.raise_for_status()
+            drinks = response.json().get("drinks") or []
         except Exception as e:
-            context.log.error(
-                f"❌ Failed to fetch drinks for {config['query_param']}={value}: {e}")
-            continue
-
-        if not drinks or drinks == 'None Found':
-            # context.log.warning(
-            #     f"No drinks found for {config['query_param']}={value}")
-            continue
+            context.log.warning(
+                f"❌ Failed to fetch details for drink '{drink_id}': {e}")
+            return None
+        return drinks[0] if drinks and isinstance(drinks[0], dict) else None
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for drink_id, detail in zip(missing, executor.map(fetch_detail, missing)):
+            if detail is None:
+                continue
+            REQUEST_CACHE.set(DETAILS_CACHE_NAMESPACE, drink_id, detail)
+            details[drink_id] = detail
 
-        for drink in drinks:
-            if isinstance(drink, dict):
-                drink[config["source_key"]] = value
-                drink_list.append(drink)
-            else:
-                context.log.warning(f"Skipping non-dict drink: {drink!r}")
+    return [details[drink_id] for drink_id in drink_ids if drink_id in details], len(missing)
 
-    df = pd.DataFrame(data=drink_list)
 
-    return Output(
-        df,
-        metadata={
-            "row_count": len(df),
-            "columns": ", ".join(df.columns),
-        }
-    )
+def fetch_dimension_values(context) -> dict:
+    """Fetches the four list.php endpoints side by side, keyed by dimension."""
+    with ThreadPoolExecutor(max_workers=len(DIMENSION_CONFIG)) as executor:
+        futures = {dimension: executor.submit(fetch_and_extract, dimension, config, context)
+                   for dimension, config in DIMENSION_CONFIG.items()}
+        return {dimension: future.result() for dimension, future in futures.items()}
 
 
-@asset(compute_kind="python", group_name="Beverages", tags={"source": "Beverages"})
-def beverages_table(context: AssetExecutionContext) -> Output:
+def fetch_dimension_drinks(values_by_dimension: dict, context) -> tuple:
+    """Fans out one filter.php request per (dimension, value) through a single worker pool.
 
-    config = DIMENSION_CONFIG["beverages"]
+    Returns the drink store keyed by idDrink and one list of link rows per dimension.
+    """
+    tasks = [(dimension, value) for dimension, values in values_by_dimension.items()
+             for value in values]
+    context.log.info(
+        f"Creating resources: {', '.join(values_by_dimension)} ({len(tasks)} lookups)")
 
-    values = fetch_and_extract("beverages", config, context)
-    context.log.info(f"Creating resource: beverages")
-    drink_list = []
-    for value in values:
+    def fetch_task(task):
+        dimension, value = task
+        config = DIMENSION_CONFIG[dimension]
         try:
-            drinks = resource_dim_request_cache(
+            return resource_dim_request_cache(
                 config['resource_name'], config['query_param'], value, context)
         except Exception as e:
             context.log.error(
                 f"❌ Failed to fetch drinks for {config['query_param']}={value}: {e}")
-            continue
+            return None
 
+    if FETCH_WORKERS > 1:
+        # executor.map keeps the input order, so row order matches a serial run
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+            results = list(executor.map(fetch_task, tasks))
+    else:
+        results = [fetch_task(task) for task in tasks]
+
+    drink_store = {}
+    links = {dimension: [] for dimension in values_by_dimension}
+    for (dimension, value), drinks in zip(tasks, results):
         if not drinks or drinks == 'None Found':
             # context.log.warning(
-            #     f"No drinks found for {config['query_param']}={value}")
+            #     f"No drinks found for {DIMENSION_CONFIG[dimension]['query_param']}={value}")
             continue
 
+        source_key = DIMENSION_CONFIG[dimension]["source_key"]
         for drink in drinks:
-            if isinstance(drink, dict):
-                drink[config["source_key"]] = value
-                drink_list.append(drink)
+            if isinstance(drink, dict) and drink.get("idDrink"):
+                drink_store.setdefault(drink["idDrink"], {
+                    "id_drink": drink["idDrink"],
+                    "str_drink": drink.get("strDrink"),
+                    "str_drink_thumb": drink.get("strDrinkThumb"),
+                })
+                links[dimension].append(
+                    {"id_drink": drink["idDrink"], source_key: value})
             else:
                 context.log.warning(f"Skipping non-dict drink: {drink!r}")
 
-    df = pd.DataFrame(data=drink_list)
+    return drink_store, links
 
-    return Output(
+
+@multi_asset(
+    outs={
+        **{config["asset_name"]: AssetOut(group_name="Beverages", tags={"source": "Beverages"},
+                                          io_manager_key="upsert_io_manager",
+                                          metadata={"primary_key": config["primary_key"]})
+           for config in DIMENSION_CONFIG.values()},
+        DRINK_STORE_NAME: AssetOut(group_name="Beverages", tags={"source": "Beverages"},
+                                   io_manager_key="upsert_io_manager",
+                                   metadata={"primary_key": ["id_drink"]}),
+    },
+    compute_kind="python",
+)
+def beverage_dimension_tables(context: AssetExecutionContext):
+    """Builds the ingredient, alcoholic, category and glass link tables plus the shared drinks table."""
+    stats_before = REQUEST_CACHE.stats(FILTER_CACHE_NAMESPACE)
+    values_by_dimension = fetch_dimension_values(context)
+    drink_store, links = fetch_dimension_drinks(values_by_dimension, context)
+
+    for dimension, config in DIMENSION_CONFIG.items():
+        df = pd.DataFrame(data=links[dimension],
+                          columns=["id_drink", config["source_key"]])
+        yield Output(
+            df,
+            output_name=config["asset_name"],
+            metadata={
+                "row_count": len(df),
+                "columns": ", ".join(df.columns),
+            }
+        )
+
+    df = pd.DataFrame(data=list(drink_store.values()),
+                      columns=["id_drink", "str_drink", "str_drink_thumb"])
+    context.log.info(
+        f"Drink store holds {len(df)} distinct drinks across {sum(len(rows) for rows in links.values())} links")
+    cache_stats = REQUEST_CACHE.stats(FILTER_CACHE_NAMESPACE)
+    refresh_errors = sum(REQUEST_CACHE.stats(namespace)["refresh_errors"]
+                         for namespace in (LIST_CACHE_NAMESPACE, FILTER_CACHE_NAMESPACE))
+    if refresh_errors:
+        context.log.warning(
+            f"⚠️ {refresh_errors} background refreshes of list.php/filter.php responses have failed in this process, "
+            "stale cached data is being served")
+    yield Output(
         df,
+        output_name=DRINK_STORE_NAME,
         metadata={
             "row_count": len(df),
             "columns": ", ".join(df.columns),
+            **{f"cache_{field}": cache_stats[field] - stats_before[field]
+               for field in cache_stats},
         }
     )
 
 
-@asset(compute_kind="python", group_name="Beverages", tags={"source": "Beverages"})
-def glass_table(context: AssetExecutionContext) -> Output:
-
-    config = DIMENSION_CONFIG["glasses"]
-
-    values = fetch_and_extract("glasses", config, context)
-    context.log.info(f"Creating resource: glasses")
-    drink_list = []
-    for value in values:
-        try:
-            drinks = resource_dim_request_cache(
-                config['resource_name'], config['query_param'], value, context)
-        except Exception as e:
-            context.log.error(
-                f"❌ Failed to fetch drinks for {config['query_param']}={value}: {e}")
-            continue
-
-        if not drinks or drinks == 'None Found':
-            # context.log.warning(
-            #     f"No drinks found for {config['query_param']}={value}")
-            continue
-
-        for drink in drinks:
-            if isinstance(drink, dict):
-                drink[config["source_key"]] = value
-                drink_list.append(drink)
-            else:
-                context.log.warning(f"Skipping non-dict drink: {drink!r}")
+@asset(compute_kind="python", group_name="Beverages", tags={"source": "Beverages"},
+       io_manager_key="upsert_io_manager", metadata={"primary_key": ["id_drink"]})
+def drink_details_table(context: AssetExecutionContext, drinks_table: pd.DataFrame) -> Output:
+    """Full recipe for every drink in drinks_table, fetched once per idDrink and cached forever."""
+    drink_ids = []
+    if "id_drink" in drinks_table.columns:
+        drink_ids = drinks_table["id_drink"].dropna().astype(str).unique().tolist()
 
-    df = pd.DataFrame(data=drink_list)
+    details, fetched = fetch_drink_details(drink_ids, context)
+    df = pd.DataFrame(details).rename(columns={"idDrink": "id_drink"})
 
     return Output(
         df,
         metadata={
             "row_count": len(df),
             "columns": ", ".join(df.columns),
+            "api_calls": fetched,
         }
     )
 
@@ -299,29 +360,7 @@ def beverage_fact_data(context, glass_table: pd.DataFrame, beverages_table: pd.D
             }
         )
 
-    url = f"https://www.thecocktaildb.com/api/json/v2/{API_KEY}/randomselection.php"
-
-    all_drinks = []
-    for i in range(10):
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            drinks = response.json().get("drinks", [])
-
-            if not drinks:
-                context.log.warning(
-                    f"No drinks returned in iteration {i+1}")
-                continue
-
-            all_drinks.extend(drinks)
-
-            time.sleep(0.2)  # Prevent throttling
-        except requests.RequestException as e:
-            context.log.error(
-                f"Request failed on iteration {i+1}: {e}", exc_info=True)
-        except Exception as e:
-            context.log.error(
-                f"Unexpected error on iteration {i+1}: {e}", exc_info=True)
+    all_drinks, requests_made = sample_random_drinks(context)
     if not all_drinks:
         context.log.warning(
             "\n⚠️  WARNING: No drinks found\n"
@@ -336,7 +375,8 @@ def beverage_fact_data(context, glass_table: pd.DataFrame, beverages_table: pd.D
             }
         )
 
-    context.log.info(f"Total drinks fetched: {len(all_drinks)}")
+    context.log.info(
+        f"Total drinks fetched: {len(all_drinks)} distinct from {requests_made} calls")
     df = pd.DataFrame(all_drinks)
 
     return Output(
@@ -344,6 +384,7 @@ def beverage_fact_data(context, glass_table: pd.DataFrame, beverages_table: pd.D
         metadata={
             "row_count": len(df),
             "columns": ", ".join(df.columns),
+            "api_calls": requests_made,
         }
     )
 
@@ -5,12 +5,293 @@ import dlt
 from dlt.pipeline.exceptions import PipelineNeverRan
 from dlt.destinations.exceptions import DatabaseUndefinedRelation
 import json
-from dlt.sources.helpers.requests import get
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from path_config import ENV_FILE, DLT_PIPELINE_DIR, DBT_DIR
+from helper_functions import HostRateLimiter, rate_limited_get
+from request_cache import get_request_cache
+from dagster_project.watermarks import query_watermarks, remember_watermarks
 
 
 load_dotenv(dotenv_path=ENV_FILE)
 COUNTRIES = ["AU", "NZ", "GB", "CA"]
+# Also read by open_meteo, which takes its weather locations from geo_cities
+GEO_PIPELINE_NAME = "geo_cities_pipeline"
+GEO_DATASET_NAME = "geo_data"
+
+BASE_URL = "http://api.geonames.org/citiesJSON"
+DETAILS_URL = "http://api.geonames.org/getJSON"
+
+# getJSON detail lookups run on this many workers, all GeoNames calls share the rate limit
+DETAIL_WORKERS = int(os.getenv("GEONAMES_DETAIL_WORKERS", "8"))
+# Free accounts are also capped at 1000 credits an hour, lower this for large first loads
+RATE_LIMITER = HostRateLimiter(
+    rate=float(os.getenv("GEONAMES_REQUESTS_PER_SECOND", "4")), burst=DETAIL_WORKERS)
+# GeoNames answers 200 with one of these in `status.value` once a daily/hourly/weekly limit is hit
+GEONAMES_LIMIT_CODES = {18, 19, 20}
+
+# citiesJSON returns at most MAX_ROWS cities per bbox, a tile that comes back full is split into four
+MAX_ROWS = int(os.getenv("GEONAMES_MAX_ROWS", "100"))
+# Deepest split (a tile is 4^-depth of the country bbox), full tiles at this depth are logged as truncated
+MAX_TILE_DEPTH = int(os.getenv("GEONAMES_MAX_TILE_DEPTH", "6"))
+# Full tiles holding none of the country's cities (e.g. the northern US inside the CA bbox) split at most
+# this many levels in a row, enough to reach a border strip without crawling the neighbour
+MAX_FOREIGN_TILE_SPLITS = int(os.getenv("GEONAMES_MAX_FOREIGN_TILE_SPLITS", "2"))
+TILE_WORKERS = int(os.getenv("GEONAMES_TILE_WORKERS", "4"))
+# Countries are extracted at the same time, their requests still share RATE_LIMITER
+COUNTRY_WORKERS = int(os.getenv("GEONAMES_COUNTRY_WORKERS", str(len(COUNTRIES))))
+
+# Country-specific bounding boxes
+BBOXES = {
+    "AU": {"north": -10.0, "south": -44.0, "east": 155.0, "west": 112.0},
+    "NZ": {"north": -33.0, "south": -47.0, "east": 180.0, "west": 166.0},
+    "GB": {"north": 60.0, "south": 49.0, "east": 1.0, "west": -8.0},
+    "CA": {"north": 83.0, "south": 42.0, "east": -52.0, "west": -140.0}
+}
+
+# citiesJSON fields that feed geo_cities, a change in any of them re-emits and re-enriches the row
+HASHED_FIELDS = ("geonameId", "name", "lat", "lng", "countrycode")
+
+# getJSON details per geonameId, kept until evicted since a city's region and country don't move
+DETAILS_CACHE_NAMESPACE = "geonames_details"
+REQUEST_CACHE = get_request_cache()
+REQUEST_CACHE.register_namespace(DETAILS_CACHE_NAMESPACE, None)
+
+
+class GeoNamesLimitError(RuntimeError):
+    """The account ran out of GeoNames credits, every further call fails until the limit resets."""
+
+
+def raise_for_geonames_status(data: dict, request: str) -> None:
+    status = data.get("status")
+    if status:
+        error = GeoNamesLimitError if status.get(
+            "value") in GEONAMES_LIMIT_CODES else RuntimeError
+        raise error(
+            f"GeoNames error {status.get('value')} for {request}: {status.get('message')}")
+
+
+def fetch_city_details(geoname_id, username: str) -> dict:
+    data = rate_limited_get(RATE_LIMITER, DETAILS_URL, params={
+        "geonameId": geoname_id,
+        "username": username
+    }).json()
+    raise_for_geonames_status(data, str(geoname_id))
+    return data
+
+
+def fetch_tile(tile: dict, username: str) -> list:
+    params = {
+        "formatted": "true",
+        "lat": "0",
+        "lng": "0",
+        "maxRows": MAX_ROWS,
+        "lang": "en",
+        "username": username
+    }
+    params.update({side: str(value) for side, value in tile.items()})
+    data = rate_limited_get(RATE_LIMITER, BASE_URL, params=params).json()
+    raise_for_geonames_status(data, f"bbox {tile}")
+    return data.get("geonames", [])
+
+
+def split_tile(tile: dict) -> list:
+    mid_lat = (tile["north"] + tile["south"]) / 2
+    mid_lng = (tile["east"] + tile["west"]) / 2
+    return [
+        {"north": tile["north"], "south": mid_lat, "east": mid_lng, "west": tile["west"]},
+        {"north": tile["north"], "south": mid_lat, "east": tile["east"], "west": mid_lng},
+        {"north": mid_lat, "south": tile["south"], "east": mid_lng, "west": tile["west"]},
+        {"north": mid_lat, "south": tile["south"], "east": tile["east"], "west": mid_lng},
+    ]
+
+
+def fetch_tiled_cities(country_code: str, bbox: dict, username: str, context) -> list:
+    """The citiesJSON rows of `country_code` in `bbox`, deduplicated on geonameId.
+
+    A tile that returns MAX_ROWS cities may have been cut off, so it is
+    split into four and each quarter is fetched, one level at a time on
+    TILE_WORKERS threads. The number of requests follows city density:
+    sparse tiles stop after one call, dense ones keep splitting. The bbox
+    overlaps neighbouring countries, whose rows are dropped here so they
+    never reach enrichment or the row counts. A full tile with none of the
+    country's rows splits only MAX_FOREIGN_TILE_SPLITS levels in a row,
+    enough to find border cities hidden behind bigger foreign ones.
+    """
+    cities_by_id = {}
+    frontier = [(bbox, 0, 0)]
+    requests_made = 0
+    truncated = 0
+    foreign_skipped = 0
+    with ThreadPoolExecutor(max_workers=TILE_WORKERS) as executor:
+        while frontier:
+            results = list(executor.map(
+                lambda tile: fetch_tile(tile[0], username), frontier))
+            requests_made += len(frontier)
+
+            next_frontier = []
+            for (tile, depth, foreign_splits), rows in zip(frontier, results):
+                own_rows = [row for row in rows if row.get("countrycode") == country_code]
+                for row in own_rows:
+                    cities_by_id.setdefault(row.get("geonameId"), row)
+                if len(rows) < MAX_ROWS:
+                    continue
+                foreign_splits = 0 if own_rows else foreign_splits + 1
+                if foreign_splits > MAX_FOREIGN_TILE_SPLITS:
+                    foreign_skipped += 1
+                elif depth < MAX_TILE_DEPTH:
+                    next_frontier.extend((sub_tile, depth + 1, foreign_splits)
+                                         for sub_tile in split_tile(tile))
+                else:
+                    truncated += 1
+            frontier = next_frontier
+
+    context.log.info(
+        f"🗺️ {len(cities_by_id)} cities for {country_code} from {requests_made} tile requests")
+    if truncated:
+        context.log.warning(
+            f"⚠️ {truncated} tiles for {country_code} were still full at depth {MAX_TILE_DEPTH}, raise GEONAMES_MAX_TILE_DEPTH for full coverage")
+    if foreign_skipped:
+        context.log.info(
+            f"🚧 {foreign_skipped} full tiles in the {country_code} bbox held only other countries' cities and weren't split further")
+    return list(cities_by_id.values())
+
+
+def fetch_cities_details(geoname_ids: list, username: str, context) -> dict:
+    """getJSON details keyed by geonameId, from the cache or fetched on DETAIL_WORKERS threads.
+
+    Lookups that fail are left out. Hitting an account limit cancels the
+    lookups that haven't started yet, since they would fail the same way.
+    """
+    details = {}
+    missing = []
+    for geoname_id in geoname_ids:
+        cached = REQUEST_CACHE.get(DETAILS_CACHE_NAMESPACE, str(geoname_id))
+        if cached is not None:
+            details[geoname_id] = cached
+        else:
+            missing.append(geoname_id)
+
+    context.log.info(
+        f"City details: {len(details)} cached, {len(missing)} to fetch")
+    if not missing:
+        return details
+
+    with ThreadPoolExecutor(max_workers=DETAIL_WORKERS) as executor:
+        futures = {executor.submit(fetch_city_details, geoname_id, username): geoname_id
+                   for geoname_id in missing}
+        for future in as_completed(futures):
+            geoname_id = futures[future]
+            if future.cancelled():
+                continue
+            try:
+                detail = future.result()
+            except GeoNamesLimitError as e:
+                context.log.error(f"🚫 {e}, skipping the remaining lookups")
+                executor.shutdown(wait=False, cancel_futures=True)
+                continue
+            except Exception as e:
+                context.log.warning(
+                    f"❌ Failed to fetch details for {geoname_id}: {e}")
+                continue
+            REQUEST_CACHE.set(DETAILS_CACHE_NAMESPACE,
+                              str(geoname_id), detail)
+            details[geoname_id] = detail
+    return details
+
+
+def row_hash(city: dict) -> str:
+    payload = json.dumps({field: city.get(field) for field in HASHED_FIELDS},
+                         sort_keys=True, default=str)
+    # 16 hex chars keep the per-row hashes in dlt state small
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def country_hash(row_hashes: dict) -> str:
+    return hashlib.sha1("".join(
+        f"{geoname_id}:{digest};" for geoname_id, digest in sorted(row_hashes.items())).encode("utf-8")).hexdigest()
+
+
+def fetch_country(country_code: str, username: str, previous: dict, database_rowcount: int, context) -> dict:
+    """Fetches, diffs and enriches one country, run on a worker thread per country.
+
+    `previous` holds the country's `processed_records`, `row_hashes` and
+    `country_hash` from dlt state. Nothing here touches dlt state, the
+    resource stores the returned `status`, `rows` and hashes.
+    """
+    context.log.info(f"Starting fetch for country: {country_code}")
+
+    try:
+        if country_code in BBOXES:
+            cities_data = fetch_tiled_cities(
+                country_code, BBOXES[country_code], username, context)
+        else:
+            # Without a bbox there is nothing to split
+            cities_data = fetch_tile({}, username)
+    except Exception as e:
+        context.log.error(
+            f"Failed to fetch cities for {country_code}: {e}")
+        raise
+
+    current_count = len(cities_data)
+
+    previous_count = previous["processed_records"]
+
+    # Keys are strings once state has been through JSON, so use them from the start
+    current_hashes = {str(city.get("geonameId")): row_hash(city)
+                      for city in cities_data}
+    previous_hashes = previous["row_hashes"]
+
+    if database_rowcount < previous_count or database_rowcount == 0:
+        context.log.info(
+            f"⚠️ GeoAPI data for `{country_code}` row count dropped from {previous_count} to {database_rowcount}. Forcing reload.")
+        previous_hashes = {}
+    elif country_hash(current_hashes) == previous["country_hash"]:
+        context.log.info(f"\n🔁 SKIPPED LOAD:\n"
+                         f"📅 Previous Run for {country_code}: {previous_count}\n"
+                         f"📦 API Cities for {country_code}: {current_count}\n"
+                         f"⏳ No new data for {country_code}. Skipping... \n"
+                         f"{'-'*45}")
+        return {"status": "skipped_no_new_data", "rows": []}
+
+    # Only added or changed rows are enriched and merged, unchanged ones are already loaded
+    changed = [city for city in cities_data
+               if previous_hashes.get(str(city.get("geonameId"))) != current_hashes[str(city.get("geonameId"))]]
+    context.log.info(
+        f"🔎 {country_code}: {len(changed)} of {current_count} cities added or changed")
+
+    # All detail lookups for the country go out together instead of one per yielded row
+    details_by_id = fetch_cities_details(
+        [city.get("geonameId") for city in changed], username, context)
+    failed_ids = [city.get("geonameId") for city in changed
+                  if city.get("geonameId") not in details_by_id]
+    if failed_ids:
+        # Successful lookups are cached, so the retry only asks for these again
+        raise RuntimeError(
+            f"Missing details for {len(failed_ids)} cities in {country_code}")
+
+    rows = []
+    for city in changed:
+        details = details_by_id.get(city.get("geonameId")) or {}
+        rows.append({
+            "city_id": city.get("geonameId"),
+            "city": city.get("name"),
+            "latitude": city.get("lat"),
+            "longitude": city.get("lng"),
+            "country": details.get("countryName") or city.get("countryName"),
+            "country_code": country_code,
+            "region": details.get("adminName1"),
+            "region_code": details.get("adminCode1"),
+            "continent": details.get("continentCode")
+        })
+
+    return {
+        "status": "success",
+        "rows": rows,
+        "processed_records": current_count,
+        "row_hashes": current_hashes,
+        "country_hash": country_hash(current_hashes),
+    }
 
 
 @dlt.source
@@ -22,6 +303,11 @@ def geo_source(context: AssetExecutionContext, row_counts_dict: dict):
             "processed_records": {},
             "country_status": {}
         })
+        # geonameId -> row_hash per country, and one hash over them per country
+        state.setdefault("row_hashes", {})
+        state.setdefault("country_hashes", {})
+        remember_watermarks("country_row_counts", [
+            [country_code, count] for country_code, count in row_counts_dict.items()])
 
         # context.log.info(f"Current state at the beginning of the run: {state}")
 
@@ -30,110 +316,40 @@ def geo_source(context: AssetExecutionContext, row_counts_dict: dict):
         if not USERNAME:
             raise ValueError("Missing GEONAMES_USERNAME in environment.")
 
-        BASE_URL = "http://api.geonames.org/citiesJSON"
-        DETAILS_URL = "http://api.geonames.org/getJSON"
-
-        def fetch_city_details(geoname_id):
-            params = {
-                "geonameId": geoname_id,
-                "username": USERNAME
-            }
-            return get(DETAILS_URL, params=params).json()
-
-        def fetch_cities(country_code):
-            max_rows = 100
-            total_fetched = 0
-
-            context.log.info(f"Starting fetch for country: {country_code}")
-
-            params = {
-                "formatted": "true",
-                "lat": "0",
-                "lng": "0",
-                "maxRows": max_rows,
-                "lang": "en",
-                "username": USERNAME
-            }
-
-            # Country-specific bounding boxes
-            bboxes = {
-                "AU": {"north": "-10.0", "south": "-44.0", "east": "155.0", "west": "112.0"},
-                "NZ": {"north": "-33.0", "south": "-47.0", "east": "180.0", "west": "166.0"},
-                "GB": {"north": "60.0", "south": "49.0", "east": "1.0", "west": "-8.0"},
-                "CA": {"north": "83.0", "south": "42.0", "east": "-52.0", "west": "-140.0"}
+        # Countries are fetched side by side, a failing one is recorded in country_status
+        # while the others keep loading
+        with ThreadPoolExecutor(max_workers=COUNTRY_WORKERS) as executor:
+            futures = {
+                executor.submit(fetch_country, country_code, USERNAME, {
+                    "processed_records": state["processed_records"].get(country_code, 0),
+                    "row_hashes": state["row_hashes"].get(country_code, {}),
+                    "country_hash": state["country_hashes"].get(country_code),
+                }, row_counts_dict.get(country_code, 0), context): country_code
+                for country_code in COUNTRIES
             }
-
-            if country_code in bboxes:
-                params.update(bboxes[country_code])
-            try:
-                response = get(BASE_URL, params=params)
-                response_json = response.json()
-                # context.log.info(
-                #     f"Raw API response for {country_code}: {json.dumps(response_json, indent=2)}")
-                cities_data = response_json.get("geonames", [])
-                # context.log.info(
-                #     f"Fetched {len(cities_data)} cities for {country_code}")
-            except Exception as e:
-                context.log.error(
-                    f"Failed to fetch cities for {country_code}: {e}")
-                state["country_status"][country_code] = "failed"
-                raise
-
-            database_rowcount = row_counts_dict.get(country_code, 0)
-
-            current_count = len(cities_data)
-
-            previous_count = state["processed_records"].get(country_code, 0)
-
-            if database_rowcount < previous_count or database_rowcount == 0:
-                context.log.info(
-                    f"⚠️ GeoAPI data for `{country_code}` row count dropped from {previous_count} to {database_rowcount}. Forcing reload.")
-                state["country_status"][country_code] = "database_row_count"
-            elif (current_count == previous_count):
-                context.log.info(f"\n🔁 SKIPPED LOAD:\n"
-                                 f"📅 Previous Run for {country_code}: {previous_count}\n"
-                                 f"📦 API Cities for {country_code}: {current_count}\n"
-                                 f"⏳ No new data for {country_code}. Skipping... \n"
-                                 f"{'-'*45}")
-                state["country_status"][country_code] = "skipped_no_new_data"
-                return
-
-            for city in cities_data:
-                context.log.info(
-                    f"Processing city: {city.get('name')} ({city.get('geonameId')}) in {country_code}")
-                total_fetched += 1
-                details = fetch_city_details(city.get("geonameId")) or {}
-
-                yield {
-                    "city_id": city.get("geonameId"),
-                    "city": city.get("name"),
-                    "latitude": city.get("lat"),
-                    "longitude": city.get("lng"),
-                    "country": details.get("countryName") or city.get("countryName"),
-                    "country_code": country_code,
-                    "region": details.get("adminName1"),
-                    "region_code": details.get("adminCode1"),
-                    "continent": details.get("continentCode")
-                }
-
-            # Update the state with the number of records processed in this run
-            state["processed_records"][country_code] = total_fetched
-            state["country_status"][country_code] = "success"
-            context.log.info(
-                f"Total cities fetched for {country_code}: {total_fetched}")
-
-        try:
-            for country in COUNTRIES:
+            for future in as_completed(futures):
+                country_code = futures[future]
                 try:
-                    yield from fetch_cities(country)
+                    result = future.result()
                 except Exception as e:
                     context.log.error(
-                        f"Error while processing country {country}: {e}")
-                    raise
-            context.log.info(f"Current state after successful run: {state}")
-        except Exception as e:
-            context.log.error(f"Processing failed: {e}")
-            raise
+                        f"Error while processing country {country_code}: {e}")
+                    state["country_status"][country_code] = "failed"
+                    continue
+
+                if result["rows"]:
+                    yield result["rows"]
+                if result["status"] != "skipped_no_new_data":
+                    # Update the state with the rows now known for the country, emitted this run or before
+                    state["processed_records"][country_code] = result["processed_records"]
+                    state["row_hashes"][country_code] = result["row_hashes"]
+                    state["country_hashes"][country_code] = result["country_hash"]
+                    context.log.info(
+                        f"Total cities emitted for {country_code}: {len(result['rows'])}")
+                state["country_status"][country_code] = result["status"]
+
+        context.log.info(
+            f"Country status after run: {state['country_status']}")
     return cities
 
 
@@ -142,22 +358,20 @@ def get_geo_data(context: AssetExecutionContext) -> bool:
 
     context.log.info("Starting DLT pipeline...")
     pipeline = dlt.pipeline(
-        pipeline_name="geo_cities_pipeline",
+        pipeline_name=GEO_PIPELINE_NAME,
         destination=os.getenv("DLT_DESTINATION", "motherduck"),
         pipelines_dir=str(DLT_PIPELINE_DIR),
-        dataset_name="geo_data",
+        dataset_name=GEO_DATASET_NAME,
         dev_mode=False
     )
 
     row_counts_dict = {}
     try:
-        dataset = pipeline.dataset()["geo_cities"].df()
-        if dataset is not None:
-            row_counts = dataset.groupby(
-                "country_code").size().reset_index(name="count")
-            if row_counts is not None:
-                row_counts_dict = dict(
-                    zip(row_counts["country_code"], row_counts["count"]))
+        row_counts = query_watermarks(pipeline, "geo_source", "country_row_counts", """
+            SELECT country_code, COUNT(*) FROM {geo_cities} GROUP BY country_code
+        """, ["geo_cities"], context)
+        row_counts_dict = {country_code: count for country_code,
+                           count in row_counts}
     except PipelineNeverRan:
         context.log.warning(
             "⚠️ No previous runs found for this pipeline. Assuming first run.")
@@ -181,6 +395,11 @@ def get_geo_data(context: AssetExecutionContext) -> bool:
 
         if any(s == "success" for s in statuses):
             context.log.info(f"Pipeline Load Info: {load_info}")
+            failed = [country for country, s in zip(
+                COUNTRIES, statuses) if s == "failed"]
+            if failed:
+                context.log.warning(
+                    f"⚠️ Countries that failed and are retried next run: {', '.join(failed)}")
             return True
         elif all(s == "skipped_no_new_data" for s in statuses):
             return False
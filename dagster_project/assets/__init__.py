@@ -1,10 +1,8 @@
 from .dbt_assets import dbt_models, dbt_common_models
-from .open_meteo import openmeteo_asset, dbt_weather_models
+from .open_meteo import openmeteo_asset, dbt_weather_models, weather_city_id_backfill
 from .Beverages import (
-    ingredients_table,
-    alcoholic_table,
-    beverages_table,
-    glass_table,
+    beverage_dimension_tables,
+    drink_details_table,
     beverage_fact_data,
     dbt_beverage_data,
 )
@@ -14,10 +12,8 @@ from .rick_and_morty import rick_and_morty_asset, dbt_rick_and_morty_models
 __all__ = [
     "dbt_models",
     "dbt_common_models",
-    "ingredients_table",
-    "alcoholic_table",
-    "beverages_table",
-    "glass_table",
+    "beverage_dimension_tables",
+    "drink_details_table",
     "beverage_fact_data",
     "dbt_beverage_data",
     "get_geo_data",
@@ -25,5 +21,6 @@ __all__ = [
     "rick_and_morty_asset",
     "dbt_rick_and_morty_models",
     "openmeteo_asset",
+    "weather_city_id_backfill",
     "dbt_weather_models",
 ]
@@ -1,51 +1,65 @@
-from dagster import asset, AssetExecutionContext
+from dagster import (asset, AssetExecutionContext, Failure, MaterializeResult, MultiPartitionsDefinition,
+                     StaticPartitionsDefinition, TimeWindowPartitionsDefinition)
 import os
-import pandas as pd
 from dotenv import load_dotenv
 from dlt.pipeline.exceptions import PipelineNeverRan
 from dlt.destinations.exceptions import DatabaseUndefinedRelation
 import dlt
-from typing import Dict, Tuple
+from dlt.common.destination import Destination
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta, date
 from zoneinfo import ZoneInfo
+from pathlib import Path
 import json
+import re
+import hashlib
+import zlib
+from collections import Counter
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from dlt.sources.helpers import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from path_config import ENV_FILE, DLT_PIPELINE_DIR
+from concurrent.futures import ThreadPoolExecutor
+from path_config import ENV_FILE, DLT_PIPELINE_DIR, REQUEST_CACHE_DIR
+from helper_functions import HostRateLimiter, bounded_as_completed
+from dagster_project.watermarks import query_watermarks, remember_watermarks
+from dagster_project.assets.GeoAPI import GEO_PIPELINE_NAME, GEO_DATASET_NAME
 
 load_dotenv(dotenv_path=ENV_FILE)
 
 
+# Fallback locations for when geo_cities can't be read, see load_locations. city_id is the GeoNames id
 cities = {
-    "Sydney": {"lat": -33.8688, "lng": 151.2093,
+    "Sydney": {"city_id": 2147714, "lat": -33.8688, "lng": 151.2093,
                "timezone": "Australia/Sydney", "country": "Australia"},
-    "Melbourne": {"lat": -37.8136, "lng": 144.9631,
+    "Melbourne": {"city_id": 2158177, "lat": -37.8136, "lng": 144.9631,
                   "timezone": "Australia/Melbourne", "country": "Australia"},
-    "Brisbane": {"lat": -27.4698, "lng": 153.0251,
+    "Brisbane": {"city_id": 2174003, "lat": -27.4698, "lng": 153.0251,
                  "timezone": "Australia/Brisbane", "country": "Australia"},
-    "Perth": {"lat": -31.9505, "lng": 115.8605,
+    "Perth": {"city_id": 2063523, "lat": -31.9505, "lng": 115.8605,
               "timezone": "Australia/Perth", "country": "Australia"},
-    "Adelaide": {"lat": -34.9285, "lng": 138.6007,
+    "Adelaide": {"city_id": 2078025, "lat": -34.9285, "lng": 138.6007,
                  "timezone": "Australia/Adelaide", "country": "Australia"},
-    "Canberra": {"lat": -35.2809,
+    "Canberra": {"city_id": 2172517, "lat": -35.2809,
                  "lng": 149.1300, "timezone": "Australia/Sydney", "country": "Australia"},
-    "Hobart": {"lat": -42.8821, "lng": 147.3272,
+    "Hobart": {"city_id": 2163355, "lat": -42.8821, "lng": 147.3272,
                "timezone": "Australia/Hobart", "country": "Australia"},
-    "Darwin": {"lat": -12.4634,
+    "Darwin": {"city_id": 2073124, "lat": -12.4634,
                "lng": 130.8456, "timezone": "Australia/Darwin", "country": "Australia"},
-    "Cairns": {"lat": -16.92366, "lng": 145.76613,
+    "Cairns": {"city_id": 2172797, "lat": -16.92366, "lng": 145.76613,
                "timezone": "Australia/Brisbane", "country": "Australia"},
-    "Alice Springs": {"lat": -23.697479, "lng": 133.883621,
+    "Alice Springs": {"city_id": 2077895, "lat": -23.697479, "lng": 133.883621,
                       "timezone": "Australia/Darwin", "country": "Australia"},
-    "Albany": {"lat": -35.02692, "lng": 117.88369,
+    "Albany": {"city_id": 2077963, "lat": -35.02692, "lng": 117.88369,
                "timezone": "Australia/Perth", "country": "Australia"},
-    "Palmerston North": {"lat": -40.3563556918218, "lng": 175.61113357543945,
+    "Palmerston North": {"city_id": 2185018, "lat": -40.3563556918218, "lng": 175.61113357543945,
                          "timezone": "Pacific/Auckland", "country": "New Zealand"},
-    "Wellington": {"lat": -41.2865, "lng": 174.7762,
+    "Wellington": {"city_id": 2179537, "lat": -41.2865, "lng": 174.7762,
                    "timezone": "Pacific/Auckland", "country": "New Zealand"},
-    "Auckland": {"lat": -36.8485, "lng": 174.7633,
+    "Auckland": {"city_id": 2193733, "lat": -36.8485, "lng": 174.7633,
                  "timezone": "Pacific/Auckland", "country": "New Zealand"},
-    "Christchurch": {"lat": -43.5321, "lng": 172.6362,
+    "Christchurch": {"city_id": 2192362, "lat": -43.5321, "lng": 172.6362,
                      "timezone": "Pacific/Auckland", "country": "New Zealand"}
 }
 
@@ -56,28 +70,233 @@ start_date = date(2021, 1, 1)
 
 BASE_URL = "https://archive-api.open-meteo.com/v1/archive"
 
+# Same countries base_geo keeps, weather for other geo_cities rows would never reach the marts
+WEATHER_COUNTRIES = ("New Zealand", "United Kingdom", "Australia", "Canada", "France")
+
+# Locations are spread over this many shards by city_id, changing it reshuffles every location
+SHARDS = int(os.getenv("OPENMETEO_SHARDS", "8"))
+
+# One partition per (year, shard), the open trailing year included, so backfills run and retry in pieces
+WEATHER_PARTITIONS = MultiPartitionsDefinition({
+    "year": TimeWindowPartitionsDefinition(
+        start=str(start_date.year), cron_schedule="0 0 1 1 *", fmt="%Y", end_offset=1),
+    "shard": StaticPartitionsDefinition([str(shard) for shard in range(SHARDS)]),
+})
+
+# Open-Meteo daily variable -> column in daily_weather
+DAILY_VARIABLES = {
+    "temperature_2m_max": "temperature_max",
+    "temperature_2m_min": "temperature_min",
+    "temperature_2m_mean": "temperature_mean",
+    "precipitation_sum": "precipitation_sum",
+    "windspeed_10m_max": "windspeed_max",
+    "windgusts_10m_max": "windgusts_max",
+    "sunshine_duration": "sunshine_duration",
+    "uv_index_max": "uv_index_max",
+}
+# Cities missing the same chunk are sent as one multi-location archive request
+MAX_LOCATIONS_PER_REQUEST = int(
+    os.getenv("OPENMETEO_LOCATIONS_PER_REQUEST", "20"))
+
+# Every (city group, yearly chunk) request is queued on one pool of this size
+WORKERS = int(os.getenv("OPENMETEO_WORKERS", "5"))
+RATE_LIMITER = HostRateLimiter(
+    rate=float(os.getenv("OPENMETEO_REQUESTS_PER_SECOND", "5")), burst=WORKERS)
+MAX_RETRIES = int(os.getenv("OPENMETEO_MAX_RETRIES", "5"))
+# Chunks queued or finished but not yet handed to dlt, caps memory on wide backfills
+MAX_CHUNKS_IN_FLIGHT = WORKERS * 2
+# Missing ranges this close together are fetched as one range, re-merging a few loaded days is cheaper than another request
+MAX_GAP_MERGE_DAYS = int(os.getenv("OPENMETEO_MAX_GAP_MERGE_DAYS", "31"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# dlt's default client retries on its own, this one leaves retries and backoff to fetch_weather_with_retry
+HTTP_CLIENT = requests.Client(request_max_attempts=1, raise_for_status=False)
+
+# daily_weather was created by dict loads, so _dlt_load_id and _dlt_id are NOT NULL there. dlt leaves both
+# out of Arrow batches unless told otherwise, and every load into the existing table would then fail
+os.environ.setdefault("NORMALIZE__PARQUET_NORMALIZER__ADD_DLT_LOAD_ID", "true")
+os.environ.setdefault("NORMALIZE__PARQUET_NORMALIZER__ADD_DLT_ID", "true")
+
+# Archive responses for closed years, one Parquet file per (location, timezone, variables, year)
+ARCHIVE_CACHE_DIR = Path(os.getenv(
+    "OPENMETEO_ARCHIVE_CACHE_DIR", REQUEST_CACHE_DIR / "open_meteo"))
+# A year is closed, and served from disk from then on, once its last day is this old
+ARCHIVE_SETTLE_DAYS = int(os.getenv("OPENMETEO_ARCHIVE_SETTLE_DAYS", "7"))
+
+
+def shard_of(city_id: int) -> int:
+    # crc32 rather than hash(), which is salted per process
+    return zlib.crc32(str(city_id).encode("utf-8")) % SHARDS
+
+
+def build_locations(rows: list) -> Dict[int, dict]:
+    """Turns geo_cities rows into locations keyed by city_id, the key daily_weather rows are merged on."""
+    return {int(city_id): {"city": str(city), "lat": float(lat), "lng": float(lng),
+                           # Resolved by the archive API from the coordinates
+                           "timezone": "auto", "country": country_code}
+            for city_id, city, country_code, lat, lng in rows}
+
+
+def fallback_locations() -> Dict[int, dict]:
+    return {info["city_id"]: {"city": name, **info} for name, info in cities.items()}
+
+
+def load_locations(context) -> Dict[int, dict]:
+    """Weather locations from geo_cities, or the built-in `cities` when it can't be read."""
+    geo_pipeline = dlt.pipeline(
+        pipeline_name=GEO_PIPELINE_NAME,
+        destination=os.getenv("DLT_DESTINATION", "motherduck"),
+        pipelines_dir=str(DLT_PIPELINE_DIR),
+        dataset_name=GEO_DATASET_NAME
+    )
+    country_list = ", ".join(f"'{country}'" for country in WEATHER_COUNTRIES)
+    try:
+        with geo_pipeline.sql_client() as client:
+            rows = client.execute_sql(f"""
+                SELECT city_id, city, country_code, latitude, longitude
+                FROM {client.make_qualified_table_name("geo_cities")}
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+                  AND country IN ({country_list})
+                ORDER BY city_id
+            """) or []
+    except Exception as e:
+        context.log.warning(
+            f"⚠️ Couldn't read geo_cities ({e}), using the built-in city list")
+        return fallback_locations()
+
+    if not rows:
+        context.log.warning(
+            "⚠️ geo_cities is empty, using the built-in city list")
+        return fallback_locations()
+    return build_locations(rows)
+
+
+def load_timestamp(timezone: str, timestamps: Dict[str, datetime]) -> datetime:
+    # One load timestamp per timezone for the whole run instead of one per row
+    if timezone not in timestamps:
+        timestamps[timezone] = datetime.now(ZoneInfo(timezone)).replace(
+            microsecond=0)
+    return timestamps[timezone]
+
+
+def get_weather_data(lats: list, lngs: list, start_date: date, end_date: date, timezones: list):
+    RATE_LIMITER.acquire(BASE_URL)
+    return HTTP_CLIENT.session.get(BASE_URL,
+                                   params={
+                                       "latitude": ",".join(str(lat) for lat in lats),
+                                       "longitude": ",".join(str(lng) for lng in lngs),
+                                       "start_date": start_date.strftime('%Y-%m-%d'),
+                                       "end_date": end_date.strftime('%Y-%m-%d'),
+                                       "daily": ",".join(DAILY_VARIABLES),
+                                       # One timezone per location, so cities in different timezones can share a request
+                                       "timezone": ",".join(timezones)
+                                   }
+                                   )
+
+
+def fetch_weather_with_retry(lats: list, lngs: list, start_date: date, end_date: date, timezones: list, context):
+    """Calls get_weather_data, backing off on 429/5xx and connection errors.
+
+    Honours Retry-After when the API sends it, otherwise waits 1, 2, 4... seconds.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = get_weather_data(
+                lats, lngs, start_date, end_date, timezones)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = min(60, 2 ** attempt)
+            context.log.warning(
+                f"🔁 Archive request failed ({e}), retrying in {delay}s")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                response.raise_for_status()
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            delay = int(retry_after) if retry_after.isdigit() else min(
+                60, 2 ** attempt)
+            context.log.warning(
+                f"🔁 Archive API answered {response.status_code}, retrying in {delay}s")
+        time.sleep(delay)
+
+
+def split_locations(data) -> list:
+    """The archive API answers one location with an object and several with a list, in request order."""
+    return data if isinstance(data, list) else [data]
+
+
+def group_cities(cities: dict, city_chunks: Dict[str, List[Tuple[date, date]]]) -> list:
+    """Batches cities that are missing the same chunk, at most MAX_LOCATIONS_PER_REQUEST each.
 
-def json_converter(o):
-    if isinstance(o, date):
-        return o.isoformat()
-    return str(o)
+    Sorting by timezone, country and longitude keeps neighbouring cities in
+    the same batch when a chunk has more cities than fit in one request.
+    """
+    grouped = {}
+    for city in sorted(city_chunks, key=lambda city_id: (cities[city_id]["timezone"], cities[city_id]["country"], cities[city_id]["lng"])):
+        for chunk in city_chunks[city]:
+            grouped.setdefault(chunk, []).append(city)
 
+    groups = []
+    for (chunk_start, chunk_end), names in sorted(grouped.items()):
+        for i in range(0, len(names), MAX_LOCATIONS_PER_REQUEST):
+            groups.append((chunk_start, chunk_end, {
+                city: cities[city] for city in names[i:i + MAX_LOCATIONS_PER_REQUEST]}))
+    return groups
 
-def get_weather_data(lat: float, lng: float, start_date: date, end_date: date, timezone: str):
-    return requests.get(BASE_URL,
-                        params={
-                            "latitude": lat,
-                            "longitude": lng,
-                            "start_date": start_date.strftime('%Y-%m-%d'),
-                            "end_date": end_date.strftime('%Y-%m-%d'),
-                            "daily": ",".join([
-                                "temperature_2m_max", "temperature_2m_min", "temperature_2m_mean",
-                                "precipitation_sum", "windspeed_10m_max", "windgusts_10m_max",
-                                "sunshine_duration", "uv_index_max"
-                            ]),
-                            "timezone": timezone
-                        }
-                        )
+
+def missing_intervals(loaded: List[Tuple[date, date]], start: date, end: date) -> List[Tuple[date, date]]:
+    """Complement of the loaded date intervals within [start, end]."""
+    gaps = []
+    cursor = start
+    for loaded_start, loaded_end in sorted(loaded):
+        if loaded_end < cursor:
+            continue
+        if loaded_start > end:
+            break
+        if loaded_start > cursor:
+            gaps.append((cursor, loaded_start - timedelta(days=1)))
+        cursor = max(cursor, loaded_end + timedelta(days=1))
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def coalesce_intervals(intervals: List[Tuple[date, date]], max_gap_days: int) -> List[Tuple[date, date]]:
+    """Merges sorted intervals separated by at most `max_gap_days` days."""
+    merged = []
+    for interval_start, interval_end in intervals:
+        if merged and (interval_start - merged[-1][1]).days - 1 <= max_gap_days:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], interval_end))
+        else:
+            merged.append((interval_start, interval_end))
+    return merged
+
+
+def query_loaded_intervals(pipeline, city_ids: List[int], window_start: date, window_end: date, context) -> Dict[int, List[Tuple[date, date]]]:
+    """Per-city islands of consecutive loaded dates inside [window_start, window_end], computed in the destination."""
+    id_list = ", ".join(str(int(city_id)) for city_id in city_ids)
+    rows = query_watermarks(pipeline, "openmeteo_source", "city_id_date_ranges", f"""
+        WITH days AS (
+            SELECT DISTINCT city_id, CAST(date AS DATE) AS day FROM {{daily_weather}}
+            WHERE city_id IN ({id_list})
+              AND CAST(date AS DATE) BETWEEN DATE '{window_start}' AND DATE '{window_end}'
+        ),
+        islands AS (
+            SELECT city_id, day,
+                   day - CAST(ROW_NUMBER() OVER (PARTITION BY city_id ORDER BY day) AS INTEGER) AS island
+            FROM days
+        )
+        SELECT city_id, MIN(day) AS start_date, MAX(day) AS end_date
+        FROM islands
+        GROUP BY city_id, island
+        ORDER BY city_id, start_date
+    """, ["daily_weather"], context)
+
+    loaded = {}
+    for city_id, interval_start, interval_end in rows:
+        loaded.setdefault(int(city_id), []).append(
+            (date.fromisoformat(interval_start), date.fromisoformat(interval_end)))
+    return loaded
 
 
 def split_into_yearly_chunks(start_date: date, end_date: date):
@@ -91,165 +310,346 @@ def split_into_yearly_chunks(start_date: date, end_date: date):
     return chunks
 
 
-def fetch_city_chunk_data(city: str, city_info: dict, city_start: date, end_date: date, context) -> Tuple[str, list]:
-    records = []
-    success = False
-    for chunk_start, chunk_end in split_into_yearly_chunks(city_start, end_date):
-        response = get_weather_data(
-            lat=city_info["lat"],
-            lng=city_info["lng"],
-            start_date=chunk_start,
-            end_date=chunk_end,
-            timezone=city_info["timezone"]
+def daily_arrays(daily: dict, timezone: Optional[str]) -> pa.Table:
+    """Turns the `daily` arrays of one archive response into a table of `time` plus the raw variables.
+
+    The timezone the API resolved for the location is kept in the schema
+    metadata, so tables read back from the archive cache still know it.
+    """
+    columns = {"time": pa.array(daily["time"], type=pa.string()).cast(pa.date32())}
+    for variable in DAILY_VARIABLES:
+        columns[variable] = pa.array(daily[variable], type=pa.float64())
+    table = pa.table(columns)
+    if timezone:
+        table = table.replace_schema_metadata({"timezone": timezone})
+    return table
+
+
+def resolved_timezone(daily: pa.Table, city_info: dict) -> str:
+    timezone = (daily.schema.metadata or {}).get(b"timezone")
+    if timezone:
+        return timezone.decode("utf-8")
+    return "UTC" if city_info["timezone"] == "auto" else city_info["timezone"]
+
+
+def daily_to_table(city_id: int, city_info: dict, daily: pa.Table, timestamp: datetime) -> pa.Table:
+    """Turns the output of daily_arrays into an Arrow batch for daily_weather.
+
+    Columns keep the names dlt produced from the old per-row dicts, including
+    the flattened `location__lat`/`location__lng`.
+    """
+    rows = daily.num_rows
+    columns = {
+        "date": daily["time"],
+        "City": pa.repeat(city_info["city"], rows),
+    }
+    for variable, column in DAILY_VARIABLES.items():
+        columns[column] = daily[variable]
+    columns["city_id"] = pa.repeat(pa.scalar(city_id, pa.int64()), rows)
+    columns["location__lat"] = pa.repeat(float(city_info["lat"]), rows)
+    columns["location__lng"] = pa.repeat(float(city_info["lng"]), rows)
+    # A typed timestamp, a string here would turn the column into text in the destination schema.
+    # Stored as UTC so cities from different timezones still share one schema in a batch
+    columns["timestamp"] = pa.repeat(pa.scalar(timestamp, pa.timestamp("s", tz="UTC")), rows)
+    return pa.table(columns)
+
+
+def table_date_range(table: pa.Table) -> Tuple[date, date]:
+    date_range = pc.min_max(table["date"])
+    return date_range["min"].as_py(), date_range["max"].as_py()
+
+
+def is_closed_year(year: int) -> bool:
+    return date(year, 12, 31) <= today - timedelta(days=ARCHIVE_SETTLE_DAYS)
+
+
+def archive_cache_path(city_info: dict, year: int) -> Path:
+    # Daily aggregates depend on the timezone, so it is part of the key with the location and variables
+    key = json.dumps([float(city_info["lat"]), float(city_info["lng"]),
+                      city_info["timezone"], sorted(DAILY_VARIABLES), year])
+    return ARCHIVE_CACHE_DIR / f"{year}" / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.parquet"
+
+
+def read_archive_cache(city_info: dict, year: int) -> Optional[pa.Table]:
+    path = archive_cache_path(city_info, year)
+    if not path.exists():
+        return None
+    try:
+        return pq.read_table(path)
+    except Exception:
+        # A truncated or unreadable file is refetched and overwritten
+        return None
+
+
+def write_archive_cache(city_info: dict, year: int, daily: pa.Table) -> None:
+    path = archive_cache_path(city_info, year)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written next to the target and renamed, so readers never see a half-written file
+    tmp_path = path.with_suffix(f".{os.getpid()}.{time.monotonic_ns()}.tmp")
+    pq.write_table(daily, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def slice_dates(daily: pa.Table, chunk_start: date, chunk_end: date) -> pa.Table:
+    mask = pc.and_(
+        pc.greater_equal(daily["time"], pa.scalar(chunk_start, pa.date32())),
+        pc.less_equal(daily["time"], pa.scalar(chunk_end, pa.date32())))
+    return daily.filter(mask)
+
+
+def fetch_group_chunk(group: dict, chunk_start: date, chunk_end: date, timestamps: Dict[str, datetime], context) -> Dict[int, Optional[pa.Table]]:
+    """Fetches one yearly chunk for a group of cities and splits it into one table per city.
+
+    Archive data for a closed year doesn't change, so the whole year is
+    fetched once, kept on disk and sliced to the chunk on later runs. Only
+    cities without a cached year, and chunks in the open trailing window, go
+    to the API.
+    """
+    names = list(group)
+    year = chunk_start.year
+    closed = is_closed_year(year)
+
+    daily_by_city = {}
+    if closed:
+        for city in names:
+            cached = read_archive_cache(group[city], year)
+            if cached is not None:
+                daily_by_city[city] = cached
+
+    to_fetch = [city for city in names if city not in daily_by_city]
+    if daily_by_city:
+        context.log.debug(
+            f"📦 {len(daily_by_city)}/{len(names)} cities served from the archive cache for {year}")
+
+    if to_fetch:
+        fetch_start, fetch_end = (date(year, 1, 1), date(
+            year, 12, 31)) if closed else (chunk_start, chunk_end)
+        response = fetch_weather_with_retry(
+            lats=[group[city]["lat"] for city in to_fetch],
+            lngs=[group[city]["lng"] for city in to_fetch],
+            start_date=fetch_start,
+            end_date=fetch_end,
+            timezones=[group[city]["timezone"] for city in to_fetch],
+            context=context
         )
-        response.raise_for_status()
-        if response.status_code != 200:
-            context.log.error(
-                f"🌐 Failed to fetch data for {city}: {response.status_code} {response.text}")
-            continue
-        data = response.json()
-        if not data or "daily" not in data:
+        locations = split_locations(response.json())
+        if len(locations) != len(to_fetch):
+            raise ValueError(
+                f"Expected {len(to_fetch)} locations from the archive API, got {len(locations)}")
+
+        for city, data in zip(to_fetch, locations):
+            if not data or "daily" not in data or not data["daily"].get("time"):
+                continue
+            daily = daily_arrays(data["daily"], data.get("timezone"))
+            if closed:
+                write_archive_cache(group[city], year, daily)
+            daily_by_city[city] = daily
+
+    tables = {}
+    for city in names:
+        daily = daily_by_city.get(city)
+        if daily is not None:
+            daily = slice_dates(daily, chunk_start, chunk_end)
+        if daily is None or daily.num_rows == 0:
             context.log.warning(
-                f"⚠️ No data found for {city} between {chunk_start} and {chunk_end}")
+                f"⚠️ No data found for {group[city]['city']} between {chunk_start} and {chunk_end}")
+            tables[city] = None
             continue
-        daily_data = data["daily"]
-        for i in range(len(daily_data["time"])):
-            success = True
-            date_val = daily_data["time"][i]
-            if not isinstance(date_val, date):
-                date_val = date.fromisoformat(date_val)
-            records.append({
-                "date": date_val,
-                "City": city,
-                "temperature_max": daily_data["temperature_2m_max"][i],
-                "temperature_min": daily_data["temperature_2m_min"][i],
-                "temperature_mean": daily_data["temperature_2m_mean"][i],
-                "precipitation_sum": daily_data["precipitation_sum"][i],
-                "windspeed_max": daily_data["windspeed_10m_max"][i],
-                "windgusts_max": daily_data["windgusts_10m_max"][i],
-                "sunshine_duration": daily_data["sunshine_duration"][i],
-                "uv_index_max": daily_data["uv_index_max"][i],
-                "location": {
-                    "lat": city_info["lat"],
-                    "lng": city_info["lng"]
-                },
-                "timestamp": datetime.now(ZoneInfo(city_info["timezone"])).replace(microsecond=0).isoformat()
-            })
-    return city, records if success else []
+        tables[city] = daily_to_table(
+            city, group[city], daily, load_timestamp(resolved_timezone(daily, group[city]), timestamps))
+    return tables
 
 
 @dlt.source
-def openmeteo_source(cities: dict, base_start_date: date, end_date: date, row_max_min: Dict[str, Dict[str, date]], context: AssetExecutionContext):
+def openmeteo_source(cities: dict, base_start_date: date, end_date: date, loaded_intervals: Dict[int, List[Tuple[date, date]]], context: AssetExecutionContext):
 
-    @dlt.resource(name="daily_weather", write_disposition="merge", primary_key=["date", "City"])
+    # City was part of the key before city_id, the explicit hint drops it from schemas stored with it
+    @dlt.resource(name="daily_weather", write_disposition="merge", primary_key=["date", "city_id"],
+                  columns={"City": {"primary_key": False}})
     def weather_resource():
         state = dlt.current.source_state().setdefault("Weather", {
             "city_date": {},
             "city_status": {},
-            "last_run_date": {"Min": str(end_date), "Max": str(end_date)},
             "last_run_status": None
         })
-
-        all_dates = []
-        futures = {}
-
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            for city, city_info in cities.items():
-                city_start = base_start_date
-
-                if city in row_max_min:
-                    max_date = row_max_min[city]['max_date']
-                    min_date = row_max_min[city]['min_date']
-                    # Whats being passed in
-                    expected_days = (end_date - base_start_date).days + 1
-                    # In the DB
-                    existing_days = (max_date - min_date).days + 1
-
-                    if existing_days >= expected_days and max_date >= end_date:
-                        context.log.info(
-                            f"✅ Skipping {city}: full data available ({existing_days}/{expected_days})")
-                        state["city_status"][city] = "skipped"
-                        continue
-                    # Given the Database has data upto: max_date, you would start fetching from: max_date + timedelta(days=1)
-                    city_start = max(
-                        max_date + timedelta(days=1), base_start_date)
-                    context.log.info(
-                        f"🔄 Updating {city}: found {existing_days}/{(end_date - min_date).days + 1} days, starting from {city_start}"
-                    )
-
-                else:
-                    context.log.info(
-                        f"🆕 New city: {city}, fetching from {city_start}")
-                # If the new fetch date is beyond the hard limit (No newer data than 2 days ago, set as global var)
-                if city_start > end_date:
-                    context.log.info(
-                        f"📭 No missing data range to fetch for {city}")
-                    state["city_status"][city] = "skipped"
+        remember_watermarks("city_id_date_ranges", [
+            [city, interval_start.isoformat(), interval_end.isoformat()]
+            for city, intervals in loaded_intervals.items()
+            for interval_start, interval_end in intervals])
+
+        # Only this run's failures, earlier ones are repaired through the gap index
+        state["failed_chunks"] = {}
+
+        city_chunks = {}
+        new_cities = 0
+        missing_days = 0
+
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            for city in cities:
+                gaps = missing_intervals(
+                    loaded_intervals.get(city, []), base_start_date, end_date)
+
+                # If nothing is missing up to the hard limit (No newer data than 2 days ago, set as global var)
+                if not gaps:
+                    state["city_status"][str(city)] = "skipped"
                     continue
 
-                futures[executor.submit(
-                    fetch_city_chunk_data, city, city_info, city_start, end_date, context)] = city
+                if city not in loaded_intervals:
+                    new_cities += 1
+                missing_days += sum((gap_end - gap_start).days + 1
+                                    for gap_start, gap_end in gaps)
+                city_chunks[city] = [chunk
+                                     for gap_start, gap_end in coalesce_intervals(gaps, MAX_GAP_MERGE_DAYS)
+                                     for chunk in split_into_yearly_chunks(gap_start, gap_end)]
 
-            for future in as_completed(futures):
-                city = futures[future]
+            # One line per run, a shard can hold thousands of cities
+            context.log.info(
+                f"✅ {len(cities) - len(city_chunks)} cities complete, "
+                f"🆕 {new_cities} new, 🔄 {len(city_chunks) - new_cities} with gaps, "
+                f"{missing_days} missing days between {base_start_date} and {end_date}")
+
+            timestamps = {}
+
+            # Queue every (group, chunk) pair so one city's backfill isn't limited to one chunk at a time,
+            # and hand each chunk to dlt as soon as it arrives instead of holding whole cities in memory
+            run_ranges = {}
+            failed_cities = set()
+            tasks = [(group, chunk_start, chunk_end, timestamps, context)
+                     for chunk_start, chunk_end, group in group_cities(cities, city_chunks)]
+            for task, future in bounded_as_completed(executor, fetch_group_chunk, tasks, MAX_CHUNKS_IN_FLIGHT):
+                group, chunk_start, chunk_end = task[0], task[1], task[2]
                 try:
-                    records = future.result()[1]
+                    chunk_tables = future.result()
                 except Exception as e:
-                    context.log.error(f"Failed fetching data for {city}: {e}")
-                    state["city_status"][city] = "failed"
+                    context.log.error(
+                        f"Failed fetching data for {', '.join(info['city'] for info in group.values())} between {chunk_start} and {chunk_end}: {e}")
+                    for city in group:
+                        failed_cities.add(city)
+                        state["failed_chunks"].setdefault(str(city), []).append(
+                            [str(chunk_start), str(chunk_end)])
                     continue
-                if records:
-                    yield records
-                    state["city_status"][city] = "success"
-                    state["city_date"][city] = {
-                        "start": records[0]["date"],
-                        "end": records[-1]["date"]
+
+                # One Arrow batch per request instead of one per city
+                loaded_tables = []
+                for city, table in chunk_tables.items():
+                    if table is None or not table.num_rows:
+                        continue
+                    loaded_tables.append(table)
+                    first_date, last_date = table_date_range(table)
+                    run_start, run_end = run_ranges.get(
+                        city, (first_date, last_date))
+                    run_ranges[city] = (
+                        min(run_start, first_date), max(run_end, last_date))
+                    state["city_date"][str(city)] = {
+                        "start": run_ranges[city][0],
+                        "end": run_ranges[city][1]
                     }
-                    all_dates.append(
-                        records[0]["date"])
-                    all_dates.append(
-                        records[-1]["date"])
+                if loaded_tables:
+                    yield pa.concat_tables(loaded_tables)
+
+            for city in city_chunks:
+                if city in run_ranges:
+                    # Chunks that did load are kept, the gap index picks up the failed ones next run
+                    state["city_status"][str(city)] = "partial" if city in failed_cities else "success"
                 else:
-                    state["city_status"][city] = "failed"
-
-            if all_dates:
-                state["last_run_date"]["Min"] = str(min(all_dates))
-                state["last_run_date"]["Max"] = str(max(all_dates))
-                state["last_run_status"] = "success"
-            else:
-                state["last_run_status"] = "no_data"
+                    state["city_status"][str(city)] = "failed"
+
+            # Loaded ranges live in the partition status and the gap index, not a min/max watermark
+            state.pop("last_run_date", None)
+            state["last_run_status"] = "success" if run_ranges else "no_data"
     return weather_resource()
 
 
-@asset(compute_kind="python", group_name="Open_Meteo", tags={"source": "Open_Meteo"}, io_manager_key="mem_io_manager")
-def openmeteo_asset(context: AssetExecutionContext) -> bool:
+@asset(compute_kind="python", group_name="Open_Meteo", tags={"source": "Open_Meteo"})
+def weather_city_id_backfill(context: AssetExecutionContext) -> MaterializeResult:
+    """One-off migration giving daily_weather rows loaded before city_id existed the id of their city.
 
-    context.log.info("Starting DLT pipeline...")
+    Those rows were only ever loaded for the built-in `cities` list, so the
+    name is enough to find the id. Materialize it once before the first
+    city_id-keyed load, otherwise the gap index misses those rows and they
+    are downloaded again next to the old ones. Running it again is harmless.
+    """
     pipeline = dlt.pipeline(
         pipeline_name="openmeteo_pipeline",
         destination=os.getenv("DLT_DESTINATION", "motherduck"),
         pipelines_dir=str(DLT_PIPELINE_DIR),
         dataset_name="weather_data"
     )
-    row_max_min_dict = {}
+    names = ", ".join("'" + name.replace("'", "''") + "'" for name in cities)
+    cases = " ".join("WHEN '" + name.replace("'", "''") + f"' THEN {info['city_id']}"
+                     for name, info in cities.items())
+    with pipeline.sql_client() as client:
+        table = client.make_qualified_table_name("daily_weather")
+        try:
+            # dlt compares against the columns the table actually has, so it won't try to add this one again
+            client.execute_sql(
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS city_id BIGINT")
+        except DatabaseUndefinedRelation:
+            context.log.info("⏭️ daily_weather doesn't exist yet, nothing to migrate")
+            return MaterializeResult(metadata={"status": "skipped", "rows_missing_city_id": 0})
+        client.execute_sql(f"""
+            UPDATE {table} SET city_id = CASE city {cases} END
+            WHERE city_id IS NULL AND city IN ({names})
+        """)
+        missing = client.execute_sql(
+            f"SELECT COUNT(*) FROM {table} WHERE city_id IS NULL")[0][0]
+
+    if missing:
+        context.log.warning(
+            f"⚠️ {missing} daily_weather rows still have no city_id, they aren't from the built-in city list")
+    else:
+        context.log.info("✅ Every daily_weather row has a city_id")
+    return MaterializeResult(metadata={"status": "success", "rows_missing_city_id": missing})
+
+
+def partition_slug(*parts: str) -> str:
+    return "_".join(re.sub(r"\W+", "_", part).strip("_").lower() for part in parts)
+
+
+@asset(compute_kind="python", group_name="Open_Meteo", tags={"source": "Open_Meteo"},
+       partitions_def=WEATHER_PARTITIONS, deps=[weather_city_id_backfill])
+def openmeteo_asset(context: AssetExecutionContext) -> MaterializeResult:
+    """Loads one shard of the geo_cities locations for one year.
+
+    The partition status is the record of what has been loaded: a partition
+    with cities that failed, or loaded only part of the year, raises so it
+    shows up as failed and can be retried on its own.
+    """
+    keys = context.partition_key.keys_by_dimension
+    year, shard = int(keys["year"]), int(keys["shard"])
+    window_start = max(date(year, 1, 1), start_date)
+    window_end = min(date(year, 12, 31), end_date)
+    if window_start > window_end:
+        context.log.info(
+            f"⏭️ Nothing to load for shard {shard} in {year} before {end_date}")
+        return MaterializeResult(metadata={"status": "skipped", "rows_loaded": 0})
+
+    locations = {city_id: location for city_id, location in load_locations(context).items()
+                 if shard_of(city_id) == shard}
+    if not locations:
+        context.log.info(f"⏭️ No cities in shard {shard}")
+        return MaterializeResult(metadata={"status": "skipped", "rows_loaded": 0})
+
+    # Each partition gets its own pipeline (state, local working dir) and staging dataset,
+    # so partitions running in parallel don't overwrite each other's merge tables
+    slug = partition_slug(str(year), f"shard_{shard}")
+    context.log.info(
+        f"Starting DLT pipeline for {len(locations)} cities in shard {shard}, {year}...")
+    pipeline = dlt.pipeline(
+        pipeline_name=f"openmeteo_pipeline_{slug}",
+        destination=Destination.from_reference(
+            os.getenv("DLT_DESTINATION", "motherduck"),
+            staging_dataset_name_layout=f"%s_staging_{slug}"),
+        pipelines_dir=str(DLT_PIPELINE_DIR),
+        dataset_name="weather_data"
+    )
+    loaded_intervals = {}
 
     try:
-        dataset = pipeline.dataset()["daily_weather"].df()
-        if dataset is not None:
-            row_max_min = dataset.groupby("city").agg(
-                min_date=("date", "min"), max_date=("date", "max")).reset_index()
-            row_max_min["min_date"] = pd.to_datetime(
-                row_max_min["min_date"]).dt.date
-            row_max_min["max_date"] = pd.to_datetime(
-                row_max_min["max_date"]).dt.date
-            row_max_min_dict = {
-                str(k): v for k, v in (
-                    row_max_min
-                    .set_index("city")[["min_date", "max_date"]]
-                    .to_dict(orient="index")
-                ).items()
-            }
-            context.log.info(f"Grouped Min and Max:\n{row_max_min}")
+        loaded_intervals = query_loaded_intervals(
+            pipeline, list(locations), window_start, window_end, context)
+        context.log.info(
+            f"Found loaded date ranges for {len(loaded_intervals)} of {len(locations)} cities")
     except PipelineNeverRan:
         context.log.warning(
             "⚠️ No previous runs found for this pipeline. Assuming first run.")
@@ -258,53 +658,51 @@ def openmeteo_asset(context: AssetExecutionContext) -> bool:
             "⚠️ Table Doesn't Exist. Assuming truncation.")
 
     source = openmeteo_source(
-        cities=cities,
-        base_start_date=start_date,
-        end_date=end_date,
-        row_max_min=row_max_min_dict,
+        cities=locations,
+        base_start_date=window_start,
+        end_date=window_end,
+        loaded_intervals=loaded_intervals,
         context=context
     )
 
-    try:
-        pipeline.run(source)
-        outcome_data = source.state.get('Weather', {})
-        context.log.info("Weather State Metadata:\n" +
-                         json.dumps(outcome_data, indent=2, default=json_converter))
-
-        statuses = [outcome_data.get("city_status", {}).get(
-            city, '') for city in cities.keys()]
-        if all(s == "skipped" for s in statuses):
-            context.log.info(
-                "\n\n ⏭️ All Cities skipped — no data loaded.")
-            return False
-        elif all(s == "failed" for s in statuses):
-            context.log.error(
-                "\n\n 💥 All cities failed to load — check API or network.")
-            return False
-
-        loaded_count = sum(1 for s in statuses if s == "success")
-        context.log.info(f"\n\n ✅ Number of cities loaded: {loaded_count}")
-
-        return True
-
-    except Exception as e:
-        context.log.error(f"\n\n ❌ Pipeline run failed: {e}")
-        return False
-
-
-@asset(deps=["openmeteo_asset"], group_name="Open_Meteo",
+    pipeline.run(source)
+    outcome_data = source.state.get('Weather', {})
+    city_status = outcome_data.get("city_status", {})
+    status_counts = Counter(city_status.get(str(city_id), "") for city_id in locations)
+    context.log.info("Weather city status:\n" +
+                     json.dumps(status_counts, indent=2))
+
+    rows_loaded = pipeline.last_trace.last_normalize_info.row_counts.get(
+        "daily_weather", 0)
+    metadata = {
+        "status_counts": dict(status_counts),
+        "rows_loaded": rows_loaded,
+        "window": f"{window_start} → {window_end}",
+    }
+    incomplete = sorted(location["city"] for city_id, location in locations.items()
+                        if city_status.get(str(city_id)) in ("failed", "partial"))
+    if incomplete:
+        raise Failure(
+            description=f"💥 {len(incomplete)} cities failed or partly loaded for {year}: "
+                        f"{', '.join(incomplete[:20])}{' ...' if len(incomplete) > 20 else ''}",
+            metadata=metadata)
+
+    if status_counts.get("skipped", 0) == len(locations):
+        context.log.info(
+            f"\n\n ⏭️ Shard {shard} {year} already loaded — no data loaded.")
+    else:
+        context.log.info(
+            f"\n\n ✅ Loaded {rows_loaded} rows for shard {shard} {year}")
+    return MaterializeResult(metadata=metadata)
+
+
+@asset(deps=[openmeteo_asset], group_name="Open_Meteo",
        tags={"source": "Open_Meteo"}, required_resource_keys={"dbt"}, io_manager_key="mem_io_manager")
-def dbt_weather_models(context: AssetExecutionContext, openmeteo_asset: bool) -> None:
-    """Runs weather-related dbt models after loading data from OpenMeteo API."""
+def dbt_weather_models(context: AssetExecutionContext) -> None:
+    """Runs weather-related dbt models after loading data from OpenMeteo API.
 
-    if not openmeteo_asset:
-        context.log.warning(
-            "\n⚠️  WARNING: DBT WEATHER MODELS SKIPPED\n"
-            "📉 No data was loaded from OpenMeteo API.\n"
-            "🚫 Skipping dbt run for weather models.\n"
-            "----------------------------------------"
-        )
-        return
+    Runs once over all partitions of openmeteo_asset rather than after each one.
+    """
 
     try:
         # Run all dbt models downstream from the weather source (source:weather+)
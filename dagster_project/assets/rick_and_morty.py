@@ -6,15 +6,25 @@ from pathlib import Path
 import dlt
 import time
 import subprocess
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from functools import partial
 from dlt.pipeline.exceptions import PipelineNeverRan
 from dlt.destinations.exceptions import DatabaseUndefinedRelation
 from dlt.sources.helpers.rest_client.paginators import JSONLinkPaginator
 from dlt.sources.helpers.rest_client.client import RESTClient
 from path_config import ENV_FILE, DLT_PIPELINE_DIR, DBT_DIR
+from rick_and_morty_api import fetch_graphql_ids, fetch_new_ids, graphql_count
 
 load_dotenv(dotenv_path="/workspaces/CamOnDagster/.env")
 
-BASE_URL = "https://rickandmortyapi.com/api"
+# Both URLs can point at a local stub server for testing
+BASE_URL = os.getenv("RICK_AND_MORTY_BASE_URL", "https://rickandmortyapi.com/api")
+GRAPHQL_URL = os.getenv("RICK_AND_MORTY_GRAPHQL_URL",
+                        "https://rickandmortyapi.com/graphql")
+# "rest" pages through the REST endpoints, "graphql" bulk-loads through *ByIds queries
+EXTRACT_MODE = os.getenv("RICK_AND_MORTY_MODE", "rest").lower()
 
 # Configuration for resources: endpoint -> primary key
 RESOURCE_CONFIG: dict[str, str] = {
@@ -23,15 +33,65 @@ RESOURCE_CONFIG: dict[str, str] = {
     "location": "id"
 }
 
+# Pages after the first are fetched this many at a time, set to 1 to follow info.next page by page
+PAGE_WORKERS = int(os.getenv("RICK_AND_MORTY_PAGE_WORKERS", "10"))
+
+# When an endpoint only grew, fetch the ids above the highest loaded one instead of every page
+INCREMENTAL_IDS = os.getenv("RICK_AND_MORTY_INCREMENTAL_IDS", "true").lower() == "true"
+IDS_PER_REQUEST = int(os.getenv("RICK_AND_MORTY_IDS_PER_REQUEST", "100"))
+# Id-based runs only add records, a periodic full reload picks up edits to older ones
+# (e.g. a character's episode list growing when a new episode airs)
+FULL_RELOAD_DAYS = int(os.getenv("RICK_AND_MORTY_FULL_RELOAD_DAYS", "7"))
+
+# GraphQL mode: ids per *ByIds query, far above the REST page size of 20
+GRAPHQL_IDS_PER_REQUEST = int(
+    os.getenv("RICK_AND_MORTY_GRAPHQL_IDS_PER_REQUEST", "500"))
+
+
+def fetch_page(client: RESTClient, table_name: str, page: int) -> list:
+    response = client.session.get(
+        f"{BASE_URL}/{table_name}", params={"page": page}, timeout=15)
+    response.raise_for_status()
+    return response.json().get("results", [])
+
+
+def fetch_pages_in_parallel(client: RESTClient, table_name: str, pages: int):
+    """Yields the results of pages 2..`pages`, requested PAGE_WORKERS at a time but in page order.
+
+    The first page reports `info.pages`, so every other page URL is known
+    up front and there's no need to wait for each `info.next`.
+    """
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        yield from executor.map(lambda page: fetch_page(client, table_name, page), range(2, pages + 1))
+
+
+def fetch_ids(client: RESTClient, table_name: str, ids: list) -> list:
+    """One multi-id request, e.g. /character/1,2,3. Ids that don't exist are left out."""
+    response = client.session.get(
+        f"{BASE_URL}/{table_name}/{','.join(str(record_id) for record_id in ids)}", timeout=15)
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    data = response.json()
+    # A single id comes back as an object rather than a list
+    return data if isinstance(data, list) else [data]
+
 
 def make_resource(table_name: str, primary_key: str, existing_count: int):
 
-    @dlt.resource(name=table_name, write_disposition="merge", primary_key=primary_key)
+    # parallelized lets dlt step the three endpoint generators on its extract thread pool,
+    # so extraction takes as long as the slowest endpoint rather than the sum
+    @dlt.resource(name=table_name, write_disposition="merge", primary_key=primary_key, parallelized=True)
     def _resource(context: AssetExecutionContext):
         state = dlt.current.source_state().setdefault(table_name, {
             "count": 0,
             "last_run_status": None
         })
+        # Highest loaded id and the date of the last full page walk, for the id-based mode
+        state.setdefault("max_id", None)
+        state.setdefault("last_full_load", None)
+        # Mode of the last completed full load, runs before GraphQL mode existed were all REST
+        state.setdefault("mode", "rest")
 
         client = RESTClient(
             base_url=f"{BASE_URL}/",
@@ -40,23 +100,44 @@ def make_resource(table_name: str, primary_key: str, existing_count: int):
             )
         )
 
-        # Only fetch first page to check count
+        # The count probe is a normal page 1 request on the client's pooled session,
+        # and its results are loaded instead of asking for page 1 again
         try:
-            response = client.session.get(
-                f"{BASE_URL}/{table_name}", timeout=15)
-            response.raise_for_status()
-            first_page = response.json()
-            info = first_page.get("info", {})
-            new_count = info.get("count", 0)
+            if EXTRACT_MODE == "graphql":
+                new_count = graphql_count(client.session, GRAPHQL_URL, table_name)
+            else:
+                response = client.session.get(
+                    f"{BASE_URL}/{table_name}", timeout=15)
+                response.raise_for_status()
+                first_page = response.json()
+                info = first_page.get("info", {})
+                new_count = info.get("count", 0)
+                pages = info.get("pages", 1)
         except Exception as e:
             context.log.error(
                 f"❌ Failed to fetch API count for `{table_name}`: {e}")
+            # Recorded in this endpoint's state only, the other endpoints keep extracting
             state["last_run_status"] = "failed"
-            raise
+            return
+
+        previous_count = state["count"]
+        full_reload_due = not state["last_full_load"] or date.fromisoformat(
+            state["last_full_load"]) <= date.today() - timedelta(days=FULL_RELOAD_DAYS)
+        # The modes load different columns (e.g. the *_ids arrays), so switching either way reloads everything
+        mode_changed = state["mode"] != EXTRACT_MODE
+        incremental = (INCREMENTAL_IDS and state["max_id"] is not None
+                       and new_count > previous_count and not full_reload_due and not mode_changed)
 
-        if existing_count < state["count"]:
+        if mode_changed:
+            context.log.info(
+                f"🔀 Extract mode for `{table_name}` changed from {state['mode']} to {EXTRACT_MODE}. Forcing reload.")
+        elif existing_count < state["count"]:
             context.log.info(
                 f"⚠️ Table `{table_name}` row count dropped from {state['count']} to {existing_count}. Forcing reload.")
+            incremental = False
+        elif full_reload_due:
+            context.log.info(
+                f"🔄 Periodic full reload of `{table_name}`, last one on {state['last_full_load'] or 'never'}")
         elif new_count == state["count"]:
             context.log.info(f"🔁 SKIPPED LOAD: `{table_name}` — No new data.")
             state["last_run_status"] = "skipped_no_new_data"
@@ -65,12 +146,64 @@ def make_resource(table_name: str, primary_key: str, existing_count: int):
         context.log.info(
             f"✅ New data for `{table_name}`: {state['count']} ➝ {new_count}")
 
-        state["count"] = new_count
+        # count only moves once the records are loaded, so a short run isn't mistaken for a complete one
         state["last_run_status"] = "success"
+        if EXTRACT_MODE == "graphql":
+            # A full load is the id walk from 0, so both cases are a handful of large queries
+            start_id = state["max_id"] if incremental else 0
+            expected = new_count - previous_count if incremental else new_count
+            fetch_batch = partial(fetch_graphql_ids, client.session, GRAPHQL_URL, BASE_URL, table_name)
+            batch_size = GRAPHQL_IDS_PER_REQUEST
+        elif incremental:
+            start_id = state["max_id"]
+            expected = new_count - previous_count
+            fetch_batch = partial(fetch_ids, client, table_name)
+            batch_size = IDS_PER_REQUEST
+
+        if EXTRACT_MODE == "graphql" or incremental:
+            context.log.info(
+                f"⏩ Loading `{table_name}` ids above {start_id} from Rick and Morty API ({EXTRACT_MODE})...")
+            records_loaded = 0
+            max_id = start_id
+            for records in fetch_new_ids(fetch_batch, start_id, expected, batch_size, PAGE_WORKERS):
+                records_loaded += len(records)
+                max_id = max(max_id, max(record[primary_key] for record in records))
+                state["max_id"] = max_id
+                yield records
+            state["count"] = previous_count + records_loaded if incremental else records_loaded
+            if records_loaded < expected:
+                context.log.warning(
+                    f"⚠️ Found {records_loaded} of {expected} expected `{table_name}` records, the next full reload fills the rest")
+            if not incremental:
+                state["last_full_load"] = date.today().isoformat()
+                state["mode"] = EXTRACT_MODE
+            return
+
         context.log.info(
             f"📊 Loading `{table_name}` data from Rick and Morty API...")
-        for page in client.paginate(table_name):
+        if PAGE_WORKERS > 1:
+            # The count probe is page 1, the rest go out together
+            pages_iter = chain([first_page.get("results", [])],
+                               fetch_pages_in_parallel(client, table_name, pages))
+        elif info.get("next"):
+            # The paginator starts from page 2, following info.next from there
+            pages_iter = chain([first_page.get("results", [])],
+                               client.paginate(info["next"]))
+        else:
+            pages_iter = [first_page.get("results", [])]
+
+        max_id = None
+        records_loaded = 0
+        for page in pages_iter:
+            if page:
+                records_loaded += len(page)
+                page_max = max(record[primary_key] for record in page)
+                max_id = page_max if max_id is None else max(max_id, page_max)
             yield page
+        state["count"] = records_loaded
+        state["max_id"] = max_id
+        state["last_full_load"] = date.today().isoformat()
+        state["mode"] = EXTRACT_MODE
 
     return _resource
 
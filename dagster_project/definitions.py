@@ -1,7 +1,7 @@
 
-from dagster_project.assets import openmeteo_asset, dbt_weather_models
+from dagster_project.assets import openmeteo_asset, dbt_weather_models, weather_city_id_backfill
 from dagster_project.assets.dbt_assets import dbt_models, dbt_common_models
-from dagster_project.jobs import open_meteo_job
+from dagster_project.jobs import open_meteo_job, weather_dbt_job
 from dagster_project.jobs import geo_data_job
 from dagster_project.assets import get_geo_data, dbt_geo_models
 from dagster_project.jobs import RickandMorty_job
@@ -12,6 +12,7 @@ from dagster_project.schedules import schedules
 from dotenv import load_dotenv
 import os
 from dagster_duckdb_pandas import DuckDBPandasIOManager
+from dagster_project.io_managers import DuckDBPandasUpsertIOManager
 
 from dagster import Definitions, DagsterInstance, mem_io_manager
 from dagster_dbt import DbtCliResource
@@ -29,6 +30,7 @@ all_assets = [
     rick_and_morty_asset,
     get_geo_data,
     openmeteo_asset,
+    weather_city_id_backfill,
     # Specific dbt model assets for each pipeline
     dbt_rick_and_morty_models,
     dbt_geo_models,
@@ -43,12 +45,13 @@ all_assets = [
 defs = Definitions(
     assets=all_assets,
     # Register only the airline job
-    jobs=[RickandMorty_job, geo_data_job, open_meteo_job],
+    jobs=[RickandMorty_job, geo_data_job, open_meteo_job, weather_dbt_job],
     schedules=[schedules]  # ,
     # sensors=[camon_sensor]
     ,
     resources={
         "io_manager": DuckDBPandasIOManager(database=MotherDuck),
+        "upsert_io_manager": DuckDBPandasUpsertIOManager(database=MotherDuck),
         "mem_io_manager": mem_io_manager,
         "dbt": DbtCliResource(project_dir=DBT_DIR, profiles_dir=DBT_DIR),
     },
@@ -62,27 +65,40 @@ if __name__ == "__main__":
         # Define shared resources
         shared_resources = {
             "io_manager": DuckDBPandasIOManager(database=MotherDuck),
+            "upsert_io_manager": DuckDBPandasUpsertIOManager(database=MotherDuck),
             "mem_io_manager": mem_io_manager,
             "dbt": DbtCliResource(project_dir=DBT_DIR, profiles_dir=DBT_DIR),
         }
 
         # List of jobs to run
         # Add more job names here
-        jobs_to_run = ["RickandMorty_job", "geo_data_job", "open_meteo_job"]
+        jobs_to_run = ["RickandMorty_job", "geo_data_job",
+                       "open_meteo_job", "weather_dbt_job"]
 
         for job_name in jobs_to_run:
-            print(f"\n🚀 Starting {job_name}...")
-            try:
-                job = defs.get_job_def(job_name)
-                result = job.execute_in_process(
-                    instance=instance,
-                    resources=shared_resources,
-                )
-                print(f"✅ {job_name} finished successfully: {result.success}")
-            except Exception as e:
-                print(f"❌ Error executing {job_name}: {e}")
-                # Continue with next job instead of stopping
-                continue
+            job = defs.get_job_def(job_name)
+            partition_keys = [None]
+            if job.partitions_def is not None:
+                # Only the latest year is refreshed here, older partitions are filled with a backfill
+                years = job.partitions_def.get_partitions_def_for_dimension(
+                    "year").get_partition_keys()
+                partition_keys = [key for key in job.partitions_def.get_partition_keys()
+                                  if key.keys_by_dimension["year"] == years[-1]]
+
+            for partition_key in partition_keys:
+                label = job_name if partition_key is None else f"{job_name} [{partition_key}]"
+                print(f"\n🚀 Starting {label}...")
+                try:
+                    result = job.execute_in_process(
+                        instance=instance,
+                        resources=shared_resources,
+                        partition_key=partition_key,
+                    )
+                    print(f"✅ {label} finished successfully: {result.success}")
+                except Exception as e:
+                    print(f"❌ Error executing {label}: {e}")
+                    # Continue with next job instead of stopping
+                    continue
 
     except Exception as e:
         print(f"💥 Fatal error: {e}")
@@ -0,0 +1,90 @@
+import duckdb
+import pandas as pd
+from dagster import ConfigurableIOManager, InputContext, OutputContext
+
+# Per-row content hash kept next to the data, used to find new or changed rows
+ROW_HASH_COLUMN = "_row_hash"
+
+
+class DuckDBPandasUpsertIOManager(ConfigurableIOManager):
+    """Stores pandas outputs in DuckDB/MotherDuck, merging on the asset's `primary_key` metadata.
+
+    Only rows whose key is new or whose content hash changed since the last
+    materialization are sent, and rows whose key disappeared upstream are
+    deleted, so the table always matches the output. Outputs without a `primary_key` (or whose columns no longer match the
+    table) are written as a full replacement.
+    """
+
+    database: str
+    schema_name: str = "public"
+
+    def _table(self, table_name: str) -> str:
+        return f'"{self.schema_name}"."{table_name}"'
+
+    def _existing_columns(self, conn, table_name: str) -> set:
+        rows = conn.execute(
+            # information_schema covers every attached database (all of them on MotherDuck)
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_catalog = current_database() AND table_schema = ? AND table_name = ?",
+            [self.schema_name, table_name]).fetchall()
+        return {row[0] for row in rows}
+
+    def handle_output(self, context: OutputContext, obj: pd.DataFrame):
+        table_name = context.asset_key.path[-1]
+        table = self._table(table_name)
+        primary_key = (context.definition_metadata or {}).get("primary_key")
+
+        df = obj.copy()
+        if primary_key:
+            df = df.drop_duplicates(subset=primary_key, keep="last")
+        df[ROW_HASH_COLUMN] = pd.util.hash_pandas_object(
+            df[sorted(obj.columns)], index=False).astype("uint64")
+
+        with duckdb.connect(self.database) as conn:
+            conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema_name}"')
+            existing_columns = self._existing_columns(conn, table_name)
+            conn.register("incoming", df)
+
+            if not primary_key or not existing_columns or set(df.columns) != existing_columns:
+                conn.execute(
+                    f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM incoming")
+                context.log.info(
+                    f"Replaced {table} with {len(df)} rows")
+                context.add_output_metadata(
+                    {"write_mode": "replace", "rows_written": len(df)})
+                return
+
+            # Only the keys and hashes come back from the destination, never the payload columns
+            existing = conn.execute(
+                f"SELECT {', '.join(primary_key)}, {ROW_HASH_COLUMN} FROM {table}").df()
+            existing = existing.drop_duplicates(subset=primary_key)
+            merged = df[primary_key + [ROW_HASH_COLUMN]].merge(
+                existing, on=primary_key, how="left", suffixes=("", "_existing"))
+            changed = df[(merged[ROW_HASH_COLUMN] !=
+                          merged[f"{ROW_HASH_COLUMN}_existing"]).to_numpy()]
+            removed = existing[primary_key].merge(
+                df[primary_key], on=primary_key, how="left", indicator=True)
+            removed = removed.loc[removed["_merge"] == "left_only", primary_key]
+
+            if not changed.empty or not removed.empty:
+                conn.register("changed", changed)
+                conn.register("removed", removed)
+                conn.execute("BEGIN TRANSACTION")
+                for source in ("changed", "removed"):
+                    key_match = " AND ".join(
+                        f"{table}.{column} = {source}.{column}" for column in primary_key)
+                    conn.execute(f"DELETE FROM {table} USING {source} WHERE {key_match}")
+                conn.execute(f"INSERT INTO {table} BY NAME SELECT * FROM changed")
+                conn.execute("COMMIT")
+
+        context.log.info(
+            f"Upserted {len(changed)} new or changed rows of {len(df)} into {table}, deleted {len(removed)}")
+        context.add_output_metadata(
+            {"write_mode": "upsert", "rows_written": len(changed), "rows_deleted": len(removed)})
+
+    def load_input(self, context: InputContext) -> pd.DataFrame:
+        table_name = context.asset_key.path[-1]
+        with duckdb.connect(self.database) as conn:
+            columns = self._existing_columns(conn, table_name)
+            exclude = f" EXCLUDE ({ROW_HASH_COLUMN})" if ROW_HASH_COLUMN in columns else ""
+            return conn.execute(f"SELECT *{exclude} FROM {self._table(table_name)}").df()
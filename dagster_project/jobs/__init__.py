@@ -1,11 +1,12 @@
 from .geo_api_job import geo_data_job
 from .rick_and_morty_job import RickandMorty_job
 from .dbt_job import dbt_job
-from .openmeteo_job import open_meteo_job
+from .openmeteo_job import open_meteo_job, weather_dbt_job
 
 __all__ = [
     "geo_data_job",
     "RickandMorty_job",
     "dbt_job",
-    "open_meteo_job"
+    "open_meteo_job",
+    "weather_dbt_job"
 ]
@@ -1,5 +1,5 @@
 from dagster import job, define_asset_job
-from dagster_project.assets.Beverages import ingredients_table, alcoholic_table, beverages_table, glass_table, beverage_fact_data, dbt_beverage_data
+from dagster_project.assets.Beverages import beverage_dimension_tables, drink_details_table, beverage_fact_data, dbt_beverage_data
 
 
 # @job(tags={"source": "Beverages"})
@@ -13,8 +13,7 @@ from dagster_project.assets.Beverages import ingredients_table, alcoholic_table,
 
 beverage_dim_job = define_asset_job(
     name="beverage_dim_job",
-    # Dagster auto-infers dependency on `ingredients_table`, `alcoholic_table`, `beverages_table`, and `glass_table`
-    selection=[ingredients_table, alcoholic_table,
-               beverages_table, glass_table,
+    # `beverage_dimension_tables` emits `ingredients_table`, `alcoholic_table`, `beverages_table`, `glass_table` and `drinks_table`
+    selection=[beverage_dimension_tables, drink_details_table,
                beverage_fact_data, dbt_beverage_data]
 )
@@ -4,6 +4,15 @@ from dagster_project.assets.open_meteo import openmeteo_asset, dbt_weather_model
 
 open_meteo_job = define_asset_job(
     name="open_meteo_job",
-    # Select both the openmeteo asset and the dbt weather models asset
-    selection=AssetSelection.assets(openmeteo_asset, dbt_weather_models)
+    # Partitioned by (year, city), backfills launch one run per partition
+    selection=AssetSelection.assets(openmeteo_asset),
+    partitions_def=openmeteo_asset.partitions_def,
+    # Parallel partition runs are capped by this tag in dagster_home/dagster.yaml, keeping the archive API rate in bounds
+    tags={"api": "open_meteo"}
+)
+
+weather_dbt_job = define_asset_job(
+    name="weather_dbt_job",
+    # dbt runs once after the partitions it depends on, not once per partition
+    selection=AssetSelection.assets(dbt_weather_models)
 )
@@ -0,0 +1,61 @@
+from datetime import date, datetime
+from typing import List, Optional
+
+import dlt
+from dlt.destinations.exceptions import DatabaseUndefinedRelation
+from dlt.pipeline.exceptions import PipelineNeverRan
+
+# Key in each source's dlt state holding the last aggregate results
+STATE_KEY = "watermarks"
+
+
+def _to_state_value(value):
+    # dlt state is JSON, keep dates as ISO strings so fresh and cached rows look the same
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def query_watermarks(pipeline, source_name: str, name: str, query: str, tables: List[str], context) -> list:
+    """Runs an aggregate `query` in the pipeline's destination and returns its rows as lists.
+
+    `query` refers to each name in `tables` as a `{placeholder}`, which is
+    replaced with the qualified table name, so only the grouped result comes
+    back over the network. If the destination can't be reached, the rows
+    stored by `remember_watermarks` on the last run are returned instead.
+    A missing table still raises, since it means the data has to be
+    (re)loaded.
+
+    The destination is queried even when this pipeline has no local state
+    yet (a new partition, a fresh runner), since other pipelines may have
+    loaded the same tables.
+    """
+    try:
+        with pipeline.sql_client() as client:
+            qualified = {table: client.make_qualified_table_name(table)
+                         for table in tables}
+            rows = client.execute_sql(query.format(**qualified)) or []
+    except (PipelineNeverRan, DatabaseUndefinedRelation):
+        raise
+    except Exception as e:
+        cached = cached_watermarks(pipeline, source_name, name)
+        if cached is None:
+            raise
+        context.log.warning(
+            f"⚠️ Watermark query `{name}` failed ({e}), using the values cached in dlt state")
+        return cached
+
+    return [[_to_state_value(value) for value in row] for row in rows]
+
+
+def cached_watermarks(pipeline, source_name: str, name: str) -> Optional[list]:
+    return pipeline.state.get("sources", {}).get(source_name, {}).get(STATE_KEY, {}).get(name)
+
+
+def remember_watermarks(name: str, rows: list) -> None:
+    """Stores watermark rows in the current source's dlt state, call from inside a resource.
+
+    They are kept as the fallback `query_watermarks` returns on the next run
+    when the destination can't be reached.
+    """
+    dlt.current.source_state().setdefault(STATE_KEY, {})[name] = rows
@@ -10,7 +10,15 @@
 -- ------------------------------------------------------------------------------
 
 
+-- RICK_AND_MORTY_MODE=graphql loads related ids as integers, the REST mode as urls
+{% if env_var('RICK_AND_MORTY_MODE', 'rest') == 'graphql' %}
+SELECT
+  _dlt_root_id AS character_dlt_id,
+  CAST(value AS INTEGER) AS episode_id
+FROM {{ source("rick_and_morty", "character__episode_ids") }}
+{% else %}
 SELECT
   _dlt_root_id AS character_dlt_id,
   CAST(regexp_replace(value, '.*/(\d+)$', '\1') AS INTEGER) AS episode_id
-FROM {{ source("rick_and_morty", "character__episode") }}
\ No newline at end of file
+FROM {{ source("rick_and_morty", "character__episode") }}
+{% endif %}
\ No newline at end of file
@@ -9,7 +9,15 @@
 -- YYYY-MM-DD | NAME     | [Add future changes here]
 -- ------------------------------------------------------------------------------
 
+-- RICK_AND_MORTY_MODE=graphql loads related ids as integers, the REST mode as urls
+{% if env_var('RICK_AND_MORTY_MODE', 'rest') == 'graphql' %}
+SELECT
+  _dlt_root_id AS episode_dlt_id,
+  CAST(value AS INTEGER) AS character_id
+FROM {{ source("rick_and_morty", "episode__character_ids") }}
+{% else %}
 SELECT
   _dlt_root_id AS episode_dlt_id,
   CAST(regexp_replace(value, '.*/(\d+)$', '\1') AS INTEGER) AS character_id
-FROM {{ source("rick_and_morty", "episode__characters") }}
\ No newline at end of file
+FROM {{ source("rick_and_morty", "episode__characters") }}
+{% endif %}
\ No newline at end of file
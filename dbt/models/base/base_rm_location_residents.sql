@@ -11,7 +11,15 @@
 -- ------------------------------------------------------------------------------
 
 
+-- RICK_AND_MORTY_MODE=graphql loads related ids as integers, the REST mode as urls
+{% if env_var('RICK_AND_MORTY_MODE', 'rest') == 'graphql' %}
+SELECT
+  _dlt_root_id AS location_dlt_id,
+  CAST(value AS INTEGER) AS character_id
+FROM {{ source("rick_and_morty", "location__resident_ids") }}
+{% else %}
 SELECT
   _dlt_root_id AS location_dlt_id,
   CAST(regexp_replace(value, '.*/(\d+)$', '\1') AS INTEGER) AS character_id
-FROM {{ source("rick_and_morty", "location__residents") }}
\ No newline at end of file
+FROM {{ source("rick_and_morty", "location__residents") }}
+{% endif %}
\ No newline at end of file
@@ -1,6 +1,11 @@
 import os
 import re
+import time
+import itertools
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
 from datetime import date
+from urllib.parse import urlsplit
 
 
 def sanitize_filename(value: str) -> str:
@@ -14,3 +19,61 @@ def json_converter(o):
     if isinstance(o, date):
         return o.isoformat()
     return str(o)
+
+
+class HostRateLimiter:
+    """Thread-safe token bucket, one bucket per host.
+
+    `rate` is requests per second, `burst` is how many requests may go out
+    back to back before the rate kicks in.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate must be greater than 0")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url: str) -> None:
+        host = urlsplit(url).netloc or url
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            # Reserve the token even when we have to wait for it, so callers queue up in order
+            tokens -= 1
+            self._buckets[host] = (tokens, now)
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+
+def rate_limited_get(limiter: HostRateLimiter, url: str, **kwargs):
+    """dlt's retrying requests.get, once `limiter` has a token for the url's host."""
+    # Imported here so the package root (which re-exports this module) stays free of dlt
+    from dlt.sources.helpers import requests as dlt_requests
+
+    limiter.acquire(url)
+    return dlt_requests.get(url, **kwargs)
+
+
+def bounded_as_completed(executor, fn, tasks, max_in_flight: int):
+    """Like submitting every task and calling as_completed, but keeps at most `max_in_flight` submitted.
+
+    Yields (task, future) pairs as they finish. Each task is a tuple of
+    arguments for `fn`. Finished results are handed back before more work is
+    queued, so memory stays bounded however many tasks there are.
+    """
+    tasks = iter(tasks)
+    pending = {}
+    for task in itertools.islice(tasks, max_in_flight):
+        pending[executor.submit(fn, *task)] = task
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            task = pending.pop(future)
+            next_task = next(tasks, None)
+            if next_task is not None:
+                pending[executor.submit(fn, *next_task)] = next_task
+            yield task, future
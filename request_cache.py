@@ -0,0 +1,314 @@
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from path_config import REQUEST_CACHE_DIR
+
+# Bump when the table layout changes, older cache files are dropped and rebuilt
+SCHEMA_VERSION = 2
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+STAT_FIELDS = ("hits", "misses", "stale_hits", "not_modified", "refresh_errors")
+# accessed_at only orders eviction, so a read skips the write when it was bumped this recently
+ACCESS_UPDATE_INTERVAL = 60 * 60
+# Pending accessed_at bumps are written together, one transaction per this many
+ACCESS_UPDATE_BATCH = 100
+# Eviction goes down to this share of max_bytes, so the next few writes don't start it again
+EVICT_TARGET_RATIO = 0.9
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    created_at: float
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fresh: bool
+
+
+class RequestCache:
+    """Single-file SQLite cache for API responses.
+
+    Entries live in namespaces, each with its own TTL in seconds (None keeps
+    entries until they are evicted). Payloads are stored as zlib-compressed
+    JSON, and once the file grows past `max_bytes` the least recently used
+    entries are dropped. The total size is tracked as entries are written,
+    and reads bump `accessed_at` at most once per ACCESS_UPDATE_INTERVAL in
+    batched writes, so hits stay read-only and a cold fill doesn't rescan
+    the table on every write. SQLite's WAL mode plus one connection per
+    thread keeps writes atomic across worker threads and processes.
+    ETag/Last-Modified validators are kept next to each payload so expired
+    entries can be revalidated with a conditional request (see
+    `conditional_get_json`).
+    """
+
+    def __init__(self, path: Path, ttls: Optional[Dict[str, Optional[float]]] = None,
+                 default_ttl: Optional[float] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._refreshing = set()
+        self._pending_access: Dict[Tuple[str, str], float] = {}
+        self._refresh_executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="request_cache_refresh")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            with conn:
+                conn.execute("DROP TABLE IF EXISTS cache")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace   TEXT NOT NULL,
+                    key         TEXT NOT NULL,
+                    payload     BLOB NOT NULL,
+                    size        INTEGER NOT NULL,
+                    created_at  REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    etag        TEXT,
+                    last_modified TEXT,
+                    PRIMARY KEY (namespace, key)
+                )""")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        # This process's view of the total size, evict() recounts it since other processes write too
+        self._size = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        atexit.register(self.flush_access_times)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, namespace: str, field: str) -> None:
+        with self._lock:
+            counters = self._stats.setdefault(
+                namespace, dict.fromkeys(STAT_FIELDS, 0))
+            counters[field] += 1
+
+    def register_namespace(self, namespace: str, ttl: Optional[float]) -> None:
+        self.ttls[namespace] = ttl
+
+    def ttl(self, namespace: str) -> Optional[float]:
+        return self.ttls.get(namespace, self.default_ttl)
+
+    def get_entry(self, namespace: str, key: str) -> Optional[CacheEntry]:
+        """Returns the entry even when it has expired, `fresh` says whether it is inside the TTL."""
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT payload, created_at, etag, last_modified, accessed_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key)).fetchone()
+        if row is None:
+            return None
+
+        now = time.time()
+        ttl = self.ttl(namespace)
+        if now - row[4] >= ACCESS_UPDATE_INTERVAL:
+            self._queue_access(namespace, key, now)
+        return CacheEntry(
+            value=json.loads(zlib.decompress(row[0])),
+            created_at=row[1],
+            etag=row[2],
+            last_modified=row[3],
+            fresh=ttl is None or now - row[1] < ttl,
+        )
+
+    def _queue_access(self, namespace: str, key: str, accessed_at: float) -> None:
+        with self._lock:
+            self._pending_access[(namespace, key)] = accessed_at
+            if len(self._pending_access) < ACCESS_UPDATE_BATCH:
+                return
+            pending, self._pending_access = self._pending_access, {}
+        self._write_access_times(pending)
+
+    def _write_access_times(self, pending: Dict[Tuple[str, str], float]) -> None:
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                [(accessed_at, namespace, key) for (namespace, key), accessed_at in pending.items()])
+
+    def flush_access_times(self) -> None:
+        """Writes the queued accessed_at bumps, called before eviction and at exit."""
+        with self._lock:
+            pending, self._pending_access = self._pending_access, {}
+        if pending:
+            self._write_access_times(pending)
+
+    def get(self, namespace: str, key: str) -> Any:
+        """Returns the cached value, or None when missing or older than the namespace TTL."""
+        entry = self.get_entry(namespace, key)
+        if entry is None or not entry.fresh:
+            self.record(namespace, "misses")
+            return None
+
+        self.record(namespace, "hits")
+        return entry.value
+
+    def set(self, namespace: str, key: str, value: Any,
+            etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        payload = zlib.compress(json.dumps(
+            value, separators=(",", ":")).encode("utf-8"))
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            replaced = conn.execute(
+                "SELECT size FROM cache WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache "
+                "(namespace, key, payload, size, created_at, accessed_at, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (namespace, key, payload, len(payload), now, now, etag, last_modified))
+        with self._lock:
+            self._size += len(payload) - (replaced[0] if replaced else 0)
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def touch(self, namespace: str, key: str) -> None:
+        """Restarts the TTL of an entry, used when the server answers 304 Not Modified."""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE cache SET created_at = ?, accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, now, namespace, key))
+
+    def delete(self, namespace: str, key: str) -> None:
+        conn = self._connection()
+        with conn:
+            deleted = conn.execute(
+                "SELECT size FROM cache WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+        if deleted:
+            with self._lock:
+                self._size -= deleted[0]
+
+    def evict(self) -> int:
+        """Drops least recently used entries once the payloads pass `max_bytes`.
+
+        Goes down to EVICT_TARGET_RATIO of `max_bytes` rather than just under
+        it, so set() only gets here again after a batch of writes.
+        """
+        self.flush_access_times()
+        conn = self._connection()
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            with self._lock:
+                self._size = total
+            return 0
+
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        evicted = 0
+        with conn:
+            rows = conn.execute(
+                "SELECT namespace, key, size FROM cache ORDER BY accessed_at").fetchall()
+            for namespace, key, size in rows:
+                if total <= target:
+                    break
+                conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+                total -= size
+                evicted += 1
+        with self._lock:
+            self._size = total
+        return evicted
+
+    def stats(self, namespace: Optional[str] = None) -> Dict[str, int]:
+        """Counters for this process, for one namespace or summed over all of them."""
+        with self._lock:
+            if namespace is not None:
+                return dict(self._stats.get(namespace, dict.fromkeys(STAT_FIELDS, 0)))
+            return {field: sum(c[field] for c in self._stats.values())
+                    for field in STAT_FIELDS}
+
+    def refresh_in_background(self, namespace: str, key: str, refresh: Callable[[], Any]) -> None:
+        """Runs `refresh` on the cache's worker threads, at most once per key at a time."""
+        with self._lock:
+            if (namespace, key) in self._refreshing:
+                return
+            self._refreshing.add((namespace, key))
+
+        def run():
+            try:
+                refresh()
+            except Exception as e:
+                # The stale value already went out and the next run retries, but a refresh that
+                # keeps failing (e.g. a revoked API key) would otherwise serve stale data silently
+                self.record(namespace, "refresh_errors")
+                logging.warning(
+                    f"Background refresh of {namespace}/{key} failed, serving the stale entry: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard((namespace, key))
+
+        self._refresh_executor.submit(run)
+
+
+def conditional_get_json(cache: RequestCache, namespace: str, key: str, url: str,
+                         get: Callable[..., Any], stale_while_revalidate: bool = False) -> Any:
+    """GETs a JSON body through the cache.
+
+    Fresh entries are returned without a request. Expired entries are
+    revalidated with If-None-Match/If-Modified-Since, and a 304 answer only
+    restarts the TTL. With `stale_while_revalidate` an expired entry is
+    returned straight away and the revalidation runs in the background.
+    `get` is the requests-style function used for the call.
+    """
+    entry = cache.get_entry(namespace, key)
+    if entry is not None and entry.fresh:
+        cache.record(namespace, "hits")
+        return entry.value
+
+    def revalidate():
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+        response = get(url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            cache.touch(namespace, key)
+            cache.record(namespace, "not_modified")
+            return entry.value
+
+        response.raise_for_status()
+        data = response.json()
+        cache.set(namespace, key, data,
+                  etag=response.headers.get("ETag"),
+                  last_modified=response.headers.get("Last-Modified"))
+        return data
+
+    if entry is not None and stale_while_revalidate:
+        cache.record(namespace, "stale_hits")
+        cache.refresh_in_background(namespace, key, revalidate)
+        return entry.value
+
+    cache.record(namespace, "misses")
+    return revalidate()
+
+
+@lru_cache(maxsize=1)
+def get_request_cache() -> RequestCache:
+    """Shared cache file in REQUEST_CACHE_DIR, callers register their TTLs with `register_namespace`."""
+    return RequestCache(REQUEST_CACHE_DIR / "request_cache.sqlite")
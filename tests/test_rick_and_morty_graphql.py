@@ -0,0 +1,127 @@
+import json
+import re
+import threading
+import urllib.request
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rick_and_morty_api import fetch_graphql_ids, fetch_new_ids, graphql_count
+
+BASE_URL = "https://api.test/api"
+
+# Character ids served by the stub, with a hole at 4 like a deleted record
+CHARACTERS = {
+    record_id: {
+        "id": str(record_id),
+        "name": f"Character {record_id}",
+        "status": "Alive",
+        "species": "Human",
+        "type": "",
+        "gender": "Female",
+        "origin": {"id": "1", "name": "Earth (C-137)"},
+        "location": None if record_id == 3 else {"id": "20", "name": "Earth (Replacement Dimension)"},
+        "image": f"https://example.test/{record_id}.jpeg",
+        "episode": [{"id": "1"}, {"id": str(record_id + 10)}],
+        "created": "2017-11-04T18:48:46.250Z",
+    }
+    for record_id in (1, 2, 3, 5, 6)
+}
+
+
+class StubGraphQLHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        query = body["query"]
+        self.server.queries.append(query)
+
+        by_ids = re.search(r"charactersByIds\(ids: \[([\d, ]*)\]\)", query)
+        if by_ids:
+            ids = [int(record_id) for record_id in by_ids.group(1).split(",") if record_id.strip()]
+            data = {"charactersByIds": [CHARACTERS.get(record_id) for record_id in ids]}
+        elif re.search(r"characters \{ info \{ count \} \}", query):
+            data = {"characters": {"info": {"count": len(CHARACTERS)}}}
+        else:
+            data = None
+
+        payload = json.dumps({"data": data} if data else {"errors": [{"message": "unknown query"}]})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(payload.encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UrllibResponse:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class UrllibSession:
+    """Covers the one requests.Session call the GraphQL helpers make, so the test needs no HTTP library."""
+
+    def post(self, url, **kwargs):
+        request = urllib.request.Request(
+            url, data=json.dumps(kwargs["json"]).encode("utf-8"),
+            headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=kwargs.get("timeout")) as response:
+            return UrllibResponse(response.read())
+
+
+@pytest.fixture
+def graphql_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGraphQLHandler)
+    server.queries = []
+    server.url = f"http://127.0.0.1:{server.server_port}/graphql"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def session():
+    return UrllibSession()
+
+
+def test_graphql_count(graphql_server, session):
+    assert graphql_count(session, graphql_server.url, "character") == len(CHARACTERS)
+    assert graphql_server.queries == ["{ characters { info { count } } }"]
+
+
+def test_by_ids_batches_walk_past_holes(graphql_server, session):
+    fetch_batch = partial(fetch_graphql_ids, session, graphql_server.url, BASE_URL, "character")
+    records = [record
+               for batch in fetch_new_ids(fetch_batch, 0, len(CHARACTERS), 2, workers=4)
+               for record in batch]
+
+    assert sorted(record["id"] for record in records) == sorted(CHARACTERS)
+    batches = [re.search(r"\[([\d, ]*)\]", query).group(1)
+               for query in graphql_server.queries]
+    # Five ids in batches of two, then one more round for the id lost to the hole
+    assert sorted(batches) == ["1, 2", "3, 4", "5", "6"]
+
+
+def test_graphql_record_shaping(graphql_server, session):
+    records = {record["id"]: record
+               for record in fetch_graphql_ids(session, graphql_server.url, BASE_URL, "character", [1, 3])}
+
+    assert records[1]["url"] == "https://api.test/api/character/1"
+    assert records[1]["origin"] == {"name": "Earth (C-137)",
+                                    "url": "https://api.test/api/location/1"}
+    assert records[1]["location"] == {"name": "Earth (Replacement Dimension)",
+                                      "url": "https://api.test/api/location/20"}
+    assert records[1]["episode_ids"] == [1, 11]
+    assert "episode" not in records[1]
+    # A missing place keeps the REST shape, with an empty url
+    assert records[3]["location"] == {"name": None, "url": ""}